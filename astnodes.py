@@ -6,185 +6,561 @@
 # This enables flexibility allowing different visitor classes in separate files
 # Each node's constructor (__init__) may store relevant information specific to that node's role in the AST.
 
-class ASTBooleanNode():
+# The visit_ method of a node is named by its visit_method, and accept runs the visitor through walk
+# so that deeply nested programs are visited with an explicit stack instead of recursion
+
+from array import array
+import contextlib
+import gc
+import threading
+from types import GeneratorType
+
+from symbol_table import SymbolIds
+
+# Pauses the cyclic garbage collector for a batch job, such as compiling a large or deeply nested program
+# A parse or a pass over the tree keeps alive every node and frame it creates until it ends, so each full
+# collection during it walks all of them again, and as they grow there are more of them, which made the time
+# per level of a deeply nested program grow with its depth (20us at 1000 levels, 50us at 64000)
+# It is not used by default, as the collector is global to the interpreter: while it is paused, reference
+# cycles made by any code, e.g. visitor methods or other threads, are not freed until it is resumed, and code
+# which turns the collector off itself during the pause finds it on again after it
+# Pauses which overlap, also from several threads, are counted, and the last to end resumes the collector if
+# the first one paused it
+@contextlib.contextmanager
+def paused_gc():
+    global gc_pauses, gc_resume
+    with gc_lock:
+        if gc_pauses == 0:
+            gc_resume = gc.isenabled()
+            gc.disable()
+        gc_pauses += 1
+    try:
+        yield
+    finally:
+        with gc_lock:
+            gc_pauses -= 1
+            if gc_pauses == 0 and gc_resume:
+                gc.enable()
+
+gc_lock = threading.Lock()
+gc_pauses = 0 # Pauses of paused_gc which have not ended
+gc_resume = False # Whether the collector was on before them
+
+# Runs a generator which yields the generators of the calls it needs and is sent back their results,
+# keeping the suspended callers on an explicit stack instead of the Python call stack
+# Returns the value the outermost generator returns, exceptions propagate as with plain calls, being thrown
+# into the caller at its yield, which can catch them, and out of run from the outermost generator
+def run(frame):
+    stack = []
+    value = None
+    error = None
+    while True:
+        try:
+            if error is None:
+                call = frame.send(value)
+            else:
+                raised, error = error, None
+                call = frame.throw(raised)
+        except StopIteration as done:
+            if not stack:
+                return done.value
+            frame = stack.pop()
+            value = done.value
+            continue
+        except Exception as raised:
+            if not stack:
+                raise
+            frame = stack.pop()
+            error = raised
+            continue
+        stack.append(frame)
+        frame = call
+        value = None
+
+# Runs the visitor over the tree under node like run, with the visit_ methods as the calls
+# A visit_ method which is a generator yields the child nodes it visits and is sent back the result of each visit,
+# any other visit_ method is called as it is and its result used directly
+# An error raised by a visit is located at the node of the innermost visit it came from by locate_error
+def walk(node, visitor):
+    try:
+        frame = getattr(visitor, node.visit_method)(node)
+    except Exception as raised:
+        locate_error(raised, node, visitor)
+        raise
+    if frame.__class__ is not GeneratorType:
+        return frame
+    return walk_frames(frame, node, visitor)
+
+# Runs the generator of the visit_ method of node and those of the visits it yields for walk
+# nodes holds the node of each suspended frame on stack
+def walk_frames(frame, node, visitor):
+    stack = []
+    nodes = []
+    value = None
+    while True:
+        try:
+            child = frame.send(value)
+        except StopIteration as done:
+            if not stack:
+                return done.value
+            frame = stack.pop()
+            node = nodes.pop()
+            value = done.value
+            continue
+        except Exception as raised:
+            locate_error(raised, node, visitor)
+            raise
+        try:
+            value = getattr(visitor, child.visit_method)(child)
+        except Exception as raised:
+            locate_error(raised, child, visitor)
+            raise
+        if value.__class__ is GeneratorType:
+            stack.append(frame)
+            nodes.append(node)
+            frame = value
+            node = child
+            value = None
+
+# Prefixes the message of an error raised by the visit of node with the line and column of node, as the syntax
+# errors are, for a visitor whose source is the SourceText of the program, set by its visit_program_node
+# An error is located once, at the innermost node, as it passes up through the visits around it
+def locate_error(raised, node, visitor):
+    source = getattr(visitor, "source", None)
+    if source is None or hasattr(raised, "node"):
+        return
+    raised.node = node
+    line, column = node.line_col(source)
+    raised.args = (f"{line}:{column}: {raised}",) + raised.args[1:]
+
+# Returns the nodes directly under node in the order of its fields
+# The body of a function left to be parsed on first use is parsed
+def child_nodes(node):
+    return nodes_in([getattr(node, field) for field in node.fields])
+
+# Returns the nodes in values in order, including those in lists and tuples in it, e.g. the sizes of array parameters
+def nodes_in(values):
+    nodes = []
+    for value in values:
+        if isinstance(value, ASTNode):
+            nodes.append(value)
+        elif value.__class__ is list or value.__class__ is tuple:
+            nodes.extend(nodes_in(value))
+    return nodes
+
+# Bump when a node class, the grammar building the nodes or encode_tree changes so that trees encoded before
+# are not decoded
+ast_version = 5
+
+# Encodes the tree under node with only builtin types, for marshal, as shapes, kinds, ends, lengths and values
+# The nodes are taken children first, and for each one kinds holds the index of its shape in shapes, ends and
+# lengths its span, and values the values of its fields other than its child nodes, all nodes in one flat list
+# A node ends where its last child does or after it, and the next node is its parent or after it, so the ends
+# never go back, and each is stored as how far it is past the one before, which is mostly under 256
+# A shape is a class name and the positions of the child nodes and of the values holding nodes, so that the
+# values of leaves are used as they are when decoding
+# kinds, ends and lengths are packed by pack_numbers, and each string is stored once in values, which
+# marshal then writes once and refers back to, so an entry is mostly the spans and the names of the program
+# The nodes form a flat list however deep the tree is, which keeps it under the nesting limit of marshal
+# The nodes are taken parent first with the children last to first, and each node its values last to first,
+# which reversed at the end is children first in order
+def encode_tree(node):
+    shapes = {}
+    strings = {}
+    kinds = []
+    ends = []
+    lengths = []
+    values = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        nodes = []
+        holders = []
+        record = []
+        # A body which was not parsed yet is parsed by getattr, as the function that parses it cannot be encoded
+        for position, field in enumerate(node.fields):
+            value = getattr(node, field)
+            if isinstance(value, ASTNode):
+                nodes.append(position)
+                stack.append(value)
+                continue
+            if value.__class__ is str:
+                value = strings.setdefault(value, value)
+            elif value.__class__ is list or value.__class__ is tuple or value.__class__ is SymbolIds:
+                count = len(stack)
+                value = encode_value(value, stack, strings)
+                if len(stack) > count or value.__class__ is dict:
+                    holders.append(position)
+            record.append(value)
+        values.extend(reversed(record))
+        kinds.append(shapes.setdefault((node.__class__.__name__, tuple(nodes), tuple(holders)), len(shapes)))
+        ends.append(node.end)
+        lengths.append(node.length)
+    kinds.reverse()
+    ends.reverse()
+    lengths.reverse()
+    values.reverse()
+    steps = [end - before for before, end in zip([0] + ends, ends)]
+    return list(shapes), pack_numbers(kinds), pack_numbers(steps), pack_numbers(lengths), values
+
+# Encodes an attribute value for encode_tree, adding the nodes in it to children in order
+# Nodes can be inside lists and tuples, e.g. the sizes of array parameters, and the SymbolIds of a program
+# is stored as a dict holding its names
+def encode_value(value, children, strings):
+    if isinstance(value, ASTNode):
+        children.append(value)
+        return ...
+    if value.__class__ is str:
+        return strings.setdefault(value, value)
+    if value.__class__ is list:
+        return [encode_value(item, children, strings) for item in value]
+    if value.__class__ is tuple:
+        return tuple(encode_value(item, children, strings) for item in value)
+    if value.__class__ is SymbolIds:
+        return {"names": value.names}
+    return value
+
+# Packs a list of non-negative integers as the typecode and bytes of an array of the smallest type holding them,
+# two to eight bytes each where marshal would take five to nine
+def pack_numbers(numbers):
+    largest = max(numbers, default=0)
+    for typecode in "BHIQ":
+        if largest < 1 << 8 * array(typecode).itemsize:
+            return typecode, array(typecode, numbers).tobytes()
+    raise OverflowError(f"{largest} is too large to pack")
+
+# Unpacks the integers packed by pack_numbers
+def unpack_numbers(packed):
+    typecode, data = packed
+    numbers = array(typecode)
+    numbers.frombytes(data)
+    return numbers
+
+# Builds the tree back from the shapes, kinds, ends, lengths and values of encode_tree and returns its root
+def decode_tree(shapes, kinds, ends, lengths, values):
+    classes = []
+    for name, nodes, holders in shapes:
+        node_class = globals()[name]
+        fields = node_class.fields
+        plain = [field for position, field in enumerate(fields) if position not in nodes]
+        # The children are on the stack in order, so they are taken from the last one back
+        slots = [(fields[i], i in nodes) for i in sorted(nodes + holders, reverse=True)]
+        classes.append((node_class, plain, slots))
+    take = iter(values).__next__
+    anchor = Anchor()
+    stack = []
+    end = 0
+    for kind, step, length in zip(unpack_numbers(kinds), unpack_numbers(ends), unpack_numbers(lengths)):
+        node_class, plain, slots = classes[kind]
+        node = node_class.__new__(node_class)
+        for field in plain:
+            setattr(node, field, take())
+        for field, is_node in slots:
+            setattr(node, field, stack.pop() if is_node else decode_value(getattr(node, field), stack))
+        end += step
+        node.anchor = anchor
+        node.offset = end - length
+        node.length = length
+        stack.append(node)
+    return stack.pop()
+
+# Decodes a list, tuple or SymbolIds from encode_value, taking its nodes from the end of stack
+def decode_value(value, stack):
+    if value is ...:
+        return stack.pop()
+    if value.__class__ is dict:
+        symbols = SymbolIds()
+        for name in value["names"]:
+            symbols.intern(name)
+        return symbols
+    if value.__class__ is list or value.__class__ is tuple:
+        items = [decode_value(item, stack) for item in reversed(value)]
+        items.reverse()
+        return items if value.__class__ is list else tuple(items)
+    return value
+
+# Shared base of the offsets of the nodes of one top-level statement, the owner, so that a reparse moves every
+# node of a statement after the edit by adding to shift instead of to the offset of each node
+# A tree decoded by decode_tree has one anchor without an owner, which shift_spans replaces statement by statement
+class Anchor:
+    __slots__ = ("shift", "owner")
+
+    def __init__(self, owner=None):
+        self.shift = 0
+        self.owner = owner
+
+# Base class of the nodes, holding the span of a node in the source from the offset start of its first character
+# to end, just past its last one, which the parser sets on every node it makes
+# The span is kept as an offset from the shift of the anchor of the node and a length like the span of a token,
+# since most lengths are small cached ints while an end would be one more int object per node
+# Every node class declares its attributes as __slots__, so no node has a __dict__, and lists them in fields
+# in the order of its constructor, which is the order of its children, for the code walking or encoding any node
+class ASTNode:
+    __slots__ = ("anchor", "offset", "length")
+
+    @property
+    def start(self):
+        return self.offset + self.anchor.shift
+
+    @start.setter
+    def start(self, start):
+        self.offset = start - self.anchor.shift
+
+    @property
+    def end(self):
+        return self.offset + self.anchor.shift + self.length
+
+    @end.setter
+    def end(self, end):
+        self.length = end - self.start
+
+    # Line and column (both starting from 1) of the start of the node in source, the SourceText of the program
+    # such as Parser.source, whose line index is built on the first lookup and shared by every node
+    def line_col(self, source):
+        return source.line_col(self.start)
+
+class ASTBooleanNode(ASTNode):
+    __slots__ = fields = ("value",)
+    name = "ASTBooleanNode"
+    visit_method = "visit_boolean_node"
+
     def __init__(self, v):
-        self.name = "ASTBooleanNode"
         self.value = v
 
     def accept(self, visitor):
-        return visitor.visit_boolean_node(self)
+        return walk(self, visitor)
+
 
+class ASTIntegerNode(ASTNode):
+    __slots__ = fields = ("value",)
+    name = "ASTIntegerNode"
+    visit_method = "visit_integer_node"
 
-class ASTIntegerNode():
     def __init__(self, v):
-        self.name = "ASTIntegerNode"
         self.value = v
 
     def accept(self, visitor):
-        return visitor.visit_integer_node(self)  
+        return walk(self, visitor)  
+
+class ASTFloatNode(ASTNode):
+    __slots__ = fields = ("value",)
+    name = "ASTFloatNode"
+    visit_method = "visit_float_node"
 
-class ASTFloatNode():
     def __init__(self, v):
-        self.name = "ASTFloatNode"
         self.value = v
 
     def accept(self, visitor):
-        return visitor.visit_float_node(self)
+        return walk(self, visitor)
+
+class ASTColourNode(ASTNode):
+    __slots__ = fields = ("value",)
+    name = "ASTColourNode"
+    visit_method = "visit_colour_node"
 
-class ASTColourNode():
     def __init__(self, v):
-        self.name = "ASTColourNode"
         self.value = v
 
     def accept(self, visitor):
-        return visitor.visit_colour_node(self)
+        return walk(self, visitor)
 
-class ASTPadWidthNode():
-    def __init__(self):
-        self.name = "ASTPadWidthNode"
+class ASTPadWidthNode(ASTNode):
+    __slots__ = fields = ()
+    name = "ASTPadWidthNode"
+    visit_method = "visit_pad_width_node"
 
     def accept(self, visitor):
-        return visitor.visit_pad_width_node(self)
+        return walk(self, visitor)
 
-class ASTPadHeightNode():
-    def __init__(self):
-        self.name = "ASTPadHeightNode"
+class ASTPadHeightNode(ASTNode):
+    __slots__ = fields = ()
+    name = "ASTPadHeightNode"
+    visit_method = "visit_pad_height_node"
 
     def accept(self, visitor):
-        return visitor.visit_pad_height_node(self)
+        return walk(self, visitor)
+
+class ASTPadReadNode(ASTNode):
+    __slots__ = fields = ("expr1", "expr2")
+    name = "ASTPadReadNode"
+    visit_method = "visit_pad_read_node"
 
-class ASTPadReadNode():
     def __init__(self, expr1, expr2):
-        self.name = "ASTPadReadNode"
         self.expr1 = expr1
         self.expr2 = expr2
 
     def accept(self, visitor):
-        return visitor.visit_pad_read_node(self)
+        return walk(self, visitor)
+
+class ASTPadRandINode(ASTNode):
+    __slots__ = fields = ("expr",)
+    name = "ASTPadRandINode"
+    visit_method = "visit_pad_rand_int_node"
 
-class ASTPadRandINode():
     def __init__(self, expr):
-        self.name = "ASTPadRandINode"
         self.expr = expr
 
     def accept(self, visitor):
-        return visitor.visit_pad_rand_int_node(self)
+        return walk(self, visitor)
+
+class ASTBinaryOpNode(ASTNode):
+    __slots__ = fields = ("op", "left", "right")
+    name = "ASTBinaryOpNode"
+    visit_method = "visit_binary_op_node"
 
-class ASTBinaryOpNode():
     def __init__(self, op, left, right):
-        self.name = "ASTBinaryOpNode"
         self.op = op              
         self.left = left          
         self.right = right        
 
     def accept(self, visitor):
-        return visitor.visit_binary_op_node(self)
+        return walk(self, visitor)
     
 
-class ASTFunctionCallNode():
-    def __init__(self, func_name, args):
-        self.name = "ASTFunctionCallNode"
+class ASTFunctionCallNode(ASTNode):
+    __slots__ = fields = ("func_name", "args", "symbol")
+    name = "ASTFunctionCallNode"
+    visit_method = "visit_function_call_node"
+
+    def __init__(self, func_name, args, symbol):
         self.func_name = func_name
         self.args = args  
+        self.symbol = symbol # Interned id of func_name
 
     def accept(self, visitor):
-        return visitor.visit_function_call_node(self)
+        return walk(self, visitor)
+
 
+class ASTUnaryOpNode(ASTNode):
+    __slots__ = fields = ("op", "operand")
+    name = "ASTUnaryOpNode"
+    visit_method = "visit_unary_op_node"
 
-class ASTUnaryOpNode():
     def __init__(self, op, operand):
-        self.name = "ASTUnaryOpNode"
         self.op = op              
         self.operand = operand    
 
     def accept(self, visitor):
-        return visitor.visit_unary_op_node(self)
+        return walk(self, visitor)
     
-class ASTAssignmentNode():
+class ASTAssignmentNode(ASTNode):
+    __slots__ = fields = ("id", "expr")
+    name = "ASTAssignmentNode"
+    visit_method = "visit_assignment_node"
+
     def __init__(self, ast_var_node, ast_expression_node):
-        self.name = "ASTAssignmentNode"        
         self.id   = ast_var_node
         self.expr = ast_expression_node
 
     def accept(self, visitor):
-        visitor.visit_assignment_node(self)
+        return walk(self, visitor)
+
+class ASTCastNode(ASTNode):
+    __slots__ = fields = ("expr", "target_type")
+    name = "ASTCastNode"
+    visit_method = "visit_cast_node"
 
-class ASTCastNode():
     def __init__(self, expr, target_type):
-        self.name = "ASTCastNode"
         self.expr = expr             
         self.target_type = target_type  
 
     def accept(self, visitor):
-        return visitor.visit_cast_node(self)
+        return walk(self, visitor)
 
-class ASTVariableDeclNode():
-    def __init__(self, identifier, vartype, expr):
-        self.name = "ASTVariableDeclNode"
+class ASTVariableDeclNode(ASTNode):
+    __slots__ = fields = ("identifier", "vartype", "expr", "symbol")
+    name = "ASTVariableDeclNode"
+    visit_method = "visit_variable_decl_node"
+
+    def __init__(self, identifier, vartype, expr, symbol):
         self.identifier = identifier  
         self.vartype = vartype        
         self.expr = expr              
+        self.symbol = symbol # Interned id of identifier
 
     def accept(self, visitor):
-        visitor.visit_variable_decl_node(self)
+        return walk(self, visitor)
+
+class ASTVariableNode(ASTNode):
+    __slots__ = fields = ("lexeme", "index_expr", "symbol")
+    name = "ASTVariableNode"
+    visit_method = "visit_variable_node"
 
-class ASTVariableNode():
-    def __init__(self, lexeme, index_expr=None):
-        self.name = "ASTVariableNode"
+    def __init__(self, lexeme, index_expr, symbol):
         self.lexeme = lexeme
         self.index_expr = index_expr
+        self.symbol = symbol # Interned id of lexeme
 
     def accept(self, visitor):
-        return visitor.visit_variable_node(self)
+        return walk(self, visitor)
 
-class ASTArrayDeclNode():
-    def __init__(self, identifier, vartype, size_expr, values):
-        self.name = "ASTArrayDeclNode"
+class ASTArrayDeclNode(ASTNode):
+    __slots__ = fields = ("identifier", "vartype", "size_expr", "values", "symbol")
+    name = "ASTArrayDeclNode"
+    visit_method = "visit_array_decl_node"
+
+    def __init__(self, identifier, vartype, size_expr, values, symbol):
         self.identifier = identifier      
         self.vartype = vartype            
         self.size_expr = size_expr       
         self.values = values              
+        self.symbol = symbol # Interned id of identifier
 
     def accept(self, visitor):
-        visitor.visit_array_decl_node(self)
+        return walk(self, visitor)
+
+class ASTPrintNode(ASTNode):
+    __slots__ = fields = ("expr",)
+    name = "ASTPrintNode"
+    visit_method = "visit_print_node"
 
-class ASTPrintNode():
     def __init__(self, expr):
-        self.name = "ASTPrintNode"
         self.expr = expr  
 
     def accept(self, visitor):
-        visitor.visit_print_node(self)
+        return walk(self, visitor)
+
+class ASTDelayNode(ASTNode):
+    __slots__ = fields = ("expr",)
+    name = "ASTDelayNode"
+    visit_method = "visit_delay_node"
 
-class ASTDelayNode():
     def __init__(self, expr):
-        self.name = "ASTDelayNode"
         self.expr = expr  
 
     def accept(self, visitor):
-        visitor.visit_delay_node(self)
+        return walk(self, visitor)
+
+class ASTClearNode(ASTNode):
+    __slots__ = fields = ("expr",)
+    name = "ASTClearNode"
+    visit_method = "visit_clear_node"
 
-class ASTClearNode():
     def __init__(self, expr):
-        self.name = "ASTClearNode"
         self.expr = expr  
 
     def accept(self, visitor):
-        visitor.visit_clear_node(self)
+        return walk(self, visitor)
+
+class ASTWriteNode(ASTNode):
+    __slots__ = fields = ("x_expr", "y_expr", "val_expr")
+    name = "ASTWriteNode"
+    visit_method = "visit_write_node"
 
-class ASTWriteNode():
     def __init__(self, x_expr, y_expr, val_expr):
-        self.name = "ASTWriteNode"
         self.x_expr = x_expr
         self.y_expr = y_expr
         self.val_expr = val_expr
 
     def accept(self, visitor):
-        visitor.visit_write_node(self)
+        return walk(self, visitor)
+
+class ASTWriteBoxNode(ASTNode):
+    __slots__ = fields = ("x_expr", "y_expr", "w_expr", "h_expr", "val_expr")
+    name = "ASTWriteBoxNode"
+    visit_method = "visit_write_box_node"
 
-class ASTWriteBoxNode():
     def __init__(self, x_expr, y_expr, w_expr, h_expr, val_expr):
-        self.name = "ASTWriteBoxNode"
         self.x_expr = x_expr
         self.y_expr = y_expr
         self.w_expr = w_expr
@@ -192,78 +568,141 @@ class ASTWriteBoxNode():
         self.val_expr = val_expr
 
     def accept(self, visitor):
-        visitor.visit_write_box_node(self)
+        return walk(self, visitor)
+
+class ASTRtrnNode(ASTNode):
+    __slots__ = fields = ("expr",)
+    name = "ASTRtrnNode"
+    visit_method = "visit_rtrn_node"
 
-class ASTRtrnNode():
     def __init__(self, expr):
-        self.name = "ASTRtrnNode"
         self.expr = expr  
 
     def accept(self, visitor):
-        visitor.visit_rtrn_node(self)
+        return walk(self, visitor)
+
+class ASTIfNode(ASTNode):
+    __slots__ = fields = ("condition_expr", "then_block", "else_block")
+    name = "ASTIfNode"
+    visit_method = "visit_if_node"
 
-class ASTIfNode():
     def __init__(self, condition_expr, then_block, else_block=None):
-        self.name = "ASTIfNode"
         self.condition_expr = condition_expr        
         self.then_block = then_block                
         self.else_block = else_block                
 
     def accept(self, visitor):
-        visitor.visit_if_node(self)
+        return walk(self, visitor)
+
+class ASTForNode(ASTNode):
+    __slots__ = fields = ("init", "condition", "update", "body")
+    name = "ASTForNode"
+    visit_method = "visit_for_node"
 
-class ASTForNode():
     def __init__(self, init, condition, update, body):
-        self.name = "ASTForNode"
         self.init = init        
         self.condition = condition  
         self.update = update    
         self.body = body        
 
     def accept(self, visitor):
-        return visitor.visit_for_node(self)
+        return walk(self, visitor)
     
-class ASTWhileNode():
+class ASTWhileNode(ASTNode):
+    __slots__ = fields = ("condition", "body")
+    name = "ASTWhileNode"
+    visit_method = "visit_while_node"
+
     def __init__(self, condition, body):
-        self.name = "ASTWhileNode"
         self.condition = condition
         self.body = body
 
     def accept(self, visitor):
-        return visitor.visit_while_node(self)
+        return walk(self, visitor)
+
+class ASTFunctionDeclNode(ASTNode):
+    __slots__ = fields = ("name", "params", "return_type", "return_size", "body", "symbol", "param_symbols")
+    visit_method = "visit_function_decl_node"
 
-class ASTFunctionDeclNode():
-    def __init__(self, name, params, return_type, return_size, body):
+    def __init__(self, name, params, return_type, return_size, body, symbol, param_symbols):
         self.name = name
         self.params = params  
         self.return_type = return_type
         self.return_size = return_size  
         self.body = body
+        self.symbol = symbol # Interned id of name
+        self.param_symbols = param_symbols # Interned ids of the parameter names, in the order of params
 
     def accept(self, visitor):
-        return visitor.visit_function_decl_node(self)
+        return walk(self, visitor)
+
+# Function declaration made by a parser with lazy_bodies, whose body is parsed by parse_body the first time it is used
+# The body property keeps the parsed body in the body slot of ASTFunctionDeclNode and sets parse_body to None,
+# after which the node is the same as an ASTFunctionDeclNode and is visited as one
+class ASTLazyFunctionDeclNode(ASTFunctionDeclNode):
+    __slots__ = ("parse_body",)
+
+    def __init__(self, name, params, return_type, return_size, parse_body, symbol, param_symbols):
+        super().__init__(name, params, return_type, return_size, None, symbol, param_symbols)
+        self.parse_body = parse_body
+
+    @property
+    def body(self):
+        if self.parse_body is not None:
+            ASTFunctionDeclNode.body.__set__(self, self.parse_body())
+            self.parse_body = None
+        return ASTFunctionDeclNode.body.__get__(self)
+
+    @body.setter
+    def body(self, body):
+        ASTFunctionDeclNode.body.__set__(self, body)
+        self.parse_body = None
+
+class ASTBlockNode(ASTNode):
+    __slots__ = fields = ("stmts",)
+    name = "ASTBlockNode"
+    visit_method = "visit_block_node"
 
-class ASTBlockNode():
     def __init__(self):
-        self.name = "ASTBlockNode"
         self.stmts = []
 
     def add_statement(self, node):
         self.stmts.append(node)
 
     def accept(self, visitor):
-        visitor.visit_block_node(self)        
+        return walk(self, visitor)        
 
-class ASTProgramNode():
-    def __init__(self):
-        self.name = "ASTProgramNode"
+# Stands in for a statement the parser skipped when recovering from a syntax error in it
+class ASTErrorNode(ASTNode):
+    __slots__ = fields = ("message",)
+    name = "ASTErrorNode"
+    visit_method = "visit_error_node"
+
+    def __init__(self, message):
+        self.message = message
+
+    def accept(self, visitor):
+        return walk(self, visitor)
+
+# source is the SourceText the program was parsed from, which the visitors locate their errors in,
+# neither it nor lazy_bodies is one of the fields as they are not encoded with the tree
+class ASTProgramNode(ASTNode):
+    __slots__ = ("stmts", "symbols", "source", "lazy_bodies")
+    fields = ("stmts", "symbols")
+    name = "ASTProgramNode"
+    visit_method = "visit_program_node"
+
+    def __init__(self, symbols, source, lazy_bodies=False):
         self.stmts = []
+        self.symbols = symbols # SymbolIds of the identifiers in the program
+        self.source = source
+        self.lazy_bodies = lazy_bodies # Whether functions in it may have bodies left to parse
 
     def add_statement(self, stmt):
         self.stmts.append(stmt)
 
     def accept(self, visitor):
-        visitor.visit_program_node(self)
+        return walk(self, visitor)
 
 # Visitor class that traverses the AST and prints the structure
 # Uses accepts, visit methods and tabs to show the structure of the tree
@@ -279,6 +718,10 @@ class PrintNodesVisitor():
     def dec_tab_count(self):
         self.tab_count -= 1
 
+    def visit_error_node(self, error_node):
+        self.node_count += 1
+        print('\t' * self.tab_count, "Error::", error_node.message)
+
     def visit_boolean_node(self, bool_node):
         self.node_count += 1
         print('\t' * self.tab_count, "Boolean value::", bool_node.value)    
@@ -307,55 +750,55 @@ class PrintNodesVisitor():
         self.node_count += 1
         print('\t' * self.tab_count, "PadRead =>")
         self.tab_count += 1
-        node.expr1.accept(self)
-        node.expr2.accept(self)
+        yield node.expr1
+        yield node.expr2
         self.tab_count -= 1
 
     def visit_pad_rand_int_node(self, node):
         self.node_count += 1
         print('\t' * self.tab_count, "PadRandInt =>")
         self.tab_count += 1
-        node.expr.accept(self)
+        yield node.expr
         self.tab_count -= 1
 
     def visit_binary_op_node(self, node):
         print('\t' * self.tab_count, f"Binary Op: {node.op}")
         self.tab_count += 1
-        node.left.accept(self)
-        node.right.accept(self)
+        yield node.left
+        yield node.right
         self.tab_count -= 1
 
     def visit_function_call_node(self, node):
         print('\t' * self.tab_count, f"Function Call: {node.func_name}()")
         self.tab_count += 1
         for arg in node.args:
-            arg.accept(self)
+            yield arg
         self.tab_count -= 1
 
     def visit_unary_op_node(self, node):
         print('\t' * self.tab_count, f"Unary Op: {node.op}")
         self.tab_count += 1
-        node.operand.accept(self)
+        yield node.operand
         self.tab_count -= 1
 
     def visit_assignment_node(self, ass_node):
         self.node_count += 1
         print('\t' * self.tab_count, "Assignment node => ")
         self.inc_tab_count()        
-        ass_node.id.accept(self)
-        ass_node.expr.accept(self)
+        yield ass_node.id
+        yield ass_node.expr
         self.dec_tab_count()
 
     def visit_cast_node(self, node):
             print('\t' * self.tab_count, f"Cast to: {node.target_type}")
             self.tab_count += 1
-            node.expr.accept(self)
+            yield node.expr
     
     def visit_variable_decl_node(self, var_decl_node):
         self.node_count += 1
         print('\t' * self.tab_count, f"Variable Declaration => {var_decl_node.identifier} : {var_decl_node.vartype}")
         self.tab_count += 1
-        var_decl_node.expr.accept(self)
+        yield var_decl_node.expr
         self.tab_count -= 1
 
         self.tab_count -= 1
@@ -367,7 +810,7 @@ class PrintNodesVisitor():
         if var_node.index_expr:
             self.tab_count += 1
             print('\t' * self.tab_count, "Index Expression =>")
-            var_node.index_expr.accept(self)
+            yield var_node.index_expr
             self.tab_count -= 1
 
     def visit_array_decl_node(self, node):
@@ -377,13 +820,13 @@ class PrintNodesVisitor():
         if node.size_expr:
             print('\t' * self.tab_count, "Declared Size:")
             self.inc_tab_count()
-            node.size_expr.accept(self)
+            yield node.size_expr
             self.dec_tab_count()
 
         print('\t' * self.tab_count, "Initial Values:")
         self.inc_tab_count()
         for val in node.values:
-            val.accept(self)
+            yield val
         self.dec_tab_count()
 
         self.dec_tab_count()
@@ -391,43 +834,43 @@ class PrintNodesVisitor():
     def visit_print_node(self, node):
         print('\t' * self.tab_count, "Print Statement =>")
         self.inc_tab_count()
-        node.expr.accept(self)
+        yield node.expr
         self.dec_tab_count()
 
     def visit_delay_node(self, node):
         print('\t' * self.tab_count, "Delay Statement =>")
         self.inc_tab_count()
-        node.expr.accept(self)
+        yield node.expr
         self.dec_tab_count()
 
     def visit_clear_node(self, node):
         print('\t' * self.tab_count, "Clear Statement =>")
         self.inc_tab_count()
-        node.expr.accept(self)
+        yield node.expr
         self.dec_tab_count()
 
     def visit_write_node(self, node):
         print('\t' * self.tab_count, "Write Statement =>")
         self.inc_tab_count()
-        node.x_expr.accept(self)
-        node.y_expr.accept(self)
-        node.val_expr.accept(self)
+        yield node.x_expr
+        yield node.y_expr
+        yield node.val_expr
         self.dec_tab_count()
 
     def visit_write_box_node(self, node):
         print('\t' * self.tab_count, "Write Box Statement =>")
         self.inc_tab_count()
-        node.x_expr.accept(self)
-        node.y_expr.accept(self)
-        node.w_expr.accept(self)
-        node.h_expr.accept(self)
-        node.val_expr.accept(self)
+        yield node.x_expr
+        yield node.y_expr
+        yield node.w_expr
+        yield node.h_expr
+        yield node.val_expr
         self.dec_tab_count()
 
     def visit_rtrn_node(self, node):
         print('\t' * self.tab_count, "Return Statement =>")
         self.inc_tab_count()
-        node.expr.accept(self)
+        yield node.expr
         self.dec_tab_count()
     
     def visit_if_node(self, node):
@@ -436,15 +879,15 @@ class PrintNodesVisitor():
 
         print('\t' * self.tab_count, "Condition:")
         self.inc_tab_count()
-        node.condition_expr.accept(self)
+        yield node.condition_expr
         self.dec_tab_count()
 
         print('\t' * self.tab_count, "Then Block:")
-        node.then_block.accept(self)
+        yield node.then_block
 
         if node.else_block:
             print('\t' * self.tab_count, "Else Block:")
-            node.else_block.accept(self)
+            yield node.else_block
 
         self.dec_tab_count()
 
@@ -455,23 +898,23 @@ class PrintNodesVisitor():
         if node.init:
             print("\t" * self.tab_count + "Initializer:")
             self.inc_tab_count()
-            node.init.accept(self)
+            yield node.init
             self.dec_tab_count()
 
         print("\t" * self.tab_count + "Condition:")
         self.inc_tab_count()
-        node.condition.accept(self)
+        yield node.condition
         self.dec_tab_count()
 
         if node.update:
             print("\t" * self.tab_count + "Update:")
             self.inc_tab_count()
-            node.update.accept(self)
+            yield node.update
             self.dec_tab_count()
 
         print("\t" * self.tab_count + "Body:")
         self.inc_tab_count()
-        node.body.accept(self)
+        yield node.body
         self.dec_tab_count()
 
         self.dec_tab_count()
@@ -482,12 +925,12 @@ class PrintNodesVisitor():
 
         print("\t" * self.tab_count + "Condition:")
         self.inc_tab_count()
-        node.condition.accept(self)
+        yield node.condition
         self.dec_tab_count()
 
         print("\t" * self.tab_count + "Body:")
         self.inc_tab_count()
-        node.body.accept(self)
+        yield node.body
         self.dec_tab_count()
 
         self.dec_tab_count()
@@ -504,7 +947,7 @@ class PrintNodesVisitor():
             if size:
                 print('\t' * self.tab_count + f"{name} : {typ} [", end="")
                 self.inc_tab_count()
-                size.accept(self)
+                yield size
                 self.dec_tab_count()
                 print('\t' * self.tab_count + "]")
             else:
@@ -515,13 +958,13 @@ class PrintNodesVisitor():
         if node.return_size:
             print('\t' * self.tab_count + "Return Size: [")
             self.inc_tab_count()
-            node.return_size.accept(self)
+            yield node.return_size
             self.dec_tab_count()
             print('\t' * self.tab_count + "]")
 
         print('\t' * self.tab_count + "Body:")
         self.inc_tab_count()
-        node.body.accept(self)
+        yield node.body
         self.dec_tab_count()
 
         self.dec_tab_count()
@@ -532,10 +975,10 @@ class PrintNodesVisitor():
         self.inc_tab_count()
         
         for st in block_node.stmts:
-            st.accept(self)
+            yield st
         
         self.dec_tab_count()
 
     def visit_program_node(self, node):
         for stmt in node.stmts:
-            stmt.accept(self)
+            yield stmt
@@ -2,6 +2,7 @@
 # To understand the semantics, check the comments in semantic_analyzer.py
 
 from astnodes import ASTIfNode, ASTRtrnNode, ASTWhileNode, ASTBlockNode, ASTVariableDeclNode, ASTFunctionDeclNode, ASTArrayDeclNode, ASTVariableNode, ASTBinaryOpNode, ASTUnaryOpNode, ASTIntegerNode, ASTForNode
+from astnodes import run
 from symbol_table import SymbolTable
 
 # Class used to generate code
@@ -11,8 +12,12 @@ class CodeGenerator:
         self.symbol_table = SymbolTable()
         self.current_return_type = None
         self.instructions = [] # List to store generated instructions
+        self.source = None # SourceText of the program, which walk locates the errors of the visits in
 
     def does_block_always_return(self, block_node):
+        return run(self.block_always_returns(block_node))
+
+    def block_always_returns(self, block_node):
 
         for stmt in block_node.stmts:
 
@@ -20,8 +25,8 @@ class CodeGenerator:
                 return True
             
             elif isinstance(stmt, ASTIfNode):
-                then_returns = self.does_block_always_return(stmt.then_block)
-                else_returns = self.does_block_always_return(stmt.else_block) if stmt.else_block else False
+                then_returns = yield self.block_always_returns(stmt.then_block)
+                else_returns = (yield self.block_always_returns(stmt.else_block)) if stmt.else_block else False
                 if then_returns and else_returns:
                     return True
                 
@@ -29,12 +34,16 @@ class CodeGenerator:
                 continue
 
             elif isinstance(stmt, ASTBlockNode):
-                if self.does_block_always_return(stmt):
+                if (yield self.block_always_returns(stmt)):
                     return True
                 
         return False
     
     def count_local_vars(self, block):
+        return run(self.count_block_vars(block))
+
+    # Nested blocks are counted by yielding them to run, so deep nesting does not recurse
+    def count_block_vars(self, block):
         count = 0
         for stmt in block.stmts:
             if isinstance(stmt, ASTVariableDeclNode):
@@ -45,13 +54,13 @@ class CodeGenerator:
                 else:
                     count += len(stmt.values)
             elif isinstance(stmt, ASTBlockNode):
-                count += self.count_local_vars(stmt)
+                count += yield self.count_block_vars(stmt)
             elif isinstance(stmt, ASTIfNode):
-                count += self.count_local_vars(stmt.then_block)
+                count += yield self.count_block_vars(stmt.then_block)
                 if stmt.else_block:
-                    count += self.count_local_vars(stmt.else_block)
+                    count += yield self.count_block_vars(stmt.else_block)
             elif isinstance(stmt, ASTWhileNode) or isinstance(stmt, ASTForNode):
-                count += self.count_local_vars(stmt.body)
+                count += yield self.count_block_vars(stmt.body)
         return count
     
     # Function used to emit instructions and store them in the instructions list
@@ -60,6 +69,7 @@ class CodeGenerator:
 
 # Visitor methods below implement type-checking 
 # rules and code generation for each AST node type
+# Like in semantic_analyzer.py the ones with child nodes yield them to astnodes.walk
 
     def visit_boolean_node(self, node):
             # Emits code for boolean literals based on
@@ -100,8 +110,8 @@ class CodeGenerator:
 
         # Switched the order of x and y 
         # to match the stack frame appoach
-        y_type = node.expr2.accept(self)
-        x_type = node.expr1.accept(self)
+        y_type = yield node.expr2
+        x_type = yield node.expr1
     
         if x_type != "int":
             raise Exception(f"Type Error: __read expects int for x, got {x_type}")
@@ -112,7 +122,7 @@ class CodeGenerator:
         return "colour"
 
     def visit_pad_rand_int_node(self, node):
-        bound_type = node.expr.accept(self)
+        bound_type = yield node.expr
         if bound_type != "int":
             raise Exception(f"Type Error: __random_int expects an int, got {bound_type}")
         self.emit("irnd")
@@ -121,8 +131,8 @@ class CodeGenerator:
     def visit_binary_op_node(self, node):
 
         # Switch the order due to stack frame approach
-        right_type = node.right.accept(self)
-        left_type = node.left.accept(self)
+        right_type = yield node.right
+        left_type = yield node.left
         if left_type != right_type:
             raise Exception(f"Type Error: Mismatched operands: {left_type} and {right_type}")
         
@@ -167,7 +177,7 @@ class CodeGenerator:
 
     def visit_function_call_node(self, node):
         
-        entry = self.symbol_table.lookup(node.func_name)
+        entry = self.symbol_table.lookup(node.symbol)
         func_entry = entry["type"]
         if func_entry is None:
             raise Exception(f"Function '{node.func_name}' not declared before use.")
@@ -184,7 +194,7 @@ class CodeGenerator:
                 
                 # Looks up the the function's array entry and gets
                 # the size of the array, index of last element and level
-                entry = self.symbol_table.lookup(arg_node.lexeme)
+                entry = self.symbol_table.lookup(arg_node.symbol)
                 index = entry["index"]
                 level = entry["level"]
                 size = entry["size"]
@@ -206,7 +216,7 @@ class CodeGenerator:
             else:
                 # Argument is not an array
                 is_array = False
-                arg_type = arg_node.accept(self)
+                arg_type = yield arg_node
                 if arg_type != param_type:
                     raise Exception(f"In call to '{node.func_name}', expected type '{param_type}' for argument '{param_name}', got '{arg_type}'.")
 
@@ -223,7 +233,7 @@ class CodeGenerator:
         return func_entry['return_type']
     
     def visit_unary_op_node(self, node):
-        operand_type = node.operand.accept(self)
+        operand_type = yield node.operand
 
         if node.op == "not":
             if operand_type != "bool":
@@ -245,16 +255,16 @@ class CodeGenerator:
 
     def visit_assignment_node(self, node):
         self.suppress_emit = True # Used to not emit the variable's value when assigning
-        var_type = node.id.accept(self)
+        var_type = yield node.id
         self.suppress_emit = False
 
-        expr_type = node.expr.accept(self)
+        expr_type = yield node.expr
         if var_type != expr_type:
             raise Exception(f"Type Error: Cannot assign {expr_type} to variable of type {var_type}")
         
         # Get index and level from lookup to push
         # and store the variable's index and access level
-        entry = self.symbol_table.lookup(node.id.lexeme)
+        entry = self.symbol_table.lookup(node.id.symbol)
         index = entry["index"]
         level = entry["level"]
         access_level = self.symbol_table.scope_levels[-1] - level
@@ -263,7 +273,7 @@ class CodeGenerator:
         self.emit("st")
         
     def visit_cast_node(self, node):
-        expr_type = node.expr.accept(self)
+        expr_type = yield node.expr
         target_type = node.target_type
 
         valid_types = {"int", "float", "bool", "colour"}
@@ -282,15 +292,15 @@ class CodeGenerator:
     
     def visit_variable_decl_node(self, node):
         var_type = node.vartype
-        self.symbol_table.declare(node.identifier, var_type)
+        self.symbol_table.declare(node.symbol, var_type)
 
-        expr_type = node.expr.accept(self)
+        expr_type = yield node.expr
         if expr_type != var_type:
             raise Exception(f"Type Error: Cannot assign {expr_type} to variable of type {var_type}")
         
         # Get index and level from lookup to push 
         # and store after declaring the variable
-        entry  = self.symbol_table.lookup(node.identifier)
+        entry  = self.symbol_table.lookup(node.symbol)
         index = entry["index"]
         level = entry["level"]
         access_level = self.symbol_table.scope_levels[-1] - level
@@ -302,7 +312,7 @@ class CodeGenerator:
 
         # Finds the entry in the symbol table
         # and gets the type, index and level
-        entry = self.symbol_table.lookup(node.lexeme)
+        entry = self.symbol_table.lookup(node.symbol)
         var_type = entry["type"]
         index = entry["index"]
         level = entry["level"]
@@ -311,7 +321,7 @@ class CodeGenerator:
         # Checks if the variable is an array
         if node.index_expr is not None:
             # Gets the index type from the index expression
-            idx_type = node.index_expr.accept(self)
+            idx_type = yield node.index_expr
             # Index expression must be an integer
             if idx_type != "int":
                 raise Exception("Type Error: Array index must be an integer")
@@ -336,20 +346,20 @@ class CodeGenerator:
 
         # Declare the variable in the symbol table
         self.symbol_table.declare(
-                node.identifier,
+                node.symbol,
                 node.vartype,
                 size=len(node.values),
                 values=node.values
             )
 
         if node.size_expr:
-            size_type = node.size_expr.accept(self)
+            size_type = yield node.size_expr
             if size_type != "int":
                 raise Exception("Type Error: Array size must be of type 'int'")
 
         # Reversed to match the stack frame approach
         for val in reversed(node.values):
-            val_type = val.accept(self)
+            val_type = yield val
             if val_type != base_type:
                 raise Exception(
                     f"Type Error: Array '{node.identifier}' expects elements of type '{base_type}', got '{val_type}'"
@@ -360,7 +370,7 @@ class CodeGenerator:
 
         # Looks up the array entry in the symbol table
         # and gets the index and level and stores the array
-        entry = self.symbol_table.lookup(node.identifier)
+        entry = self.symbol_table.lookup(node.symbol)
         index = entry["index"]
         level = entry["level"]
         access_level = self.symbol_table.scope_levels[-1] - level
@@ -369,25 +379,25 @@ class CodeGenerator:
         self.emit("sta")
 
     def visit_print_node(self, node):
-        node.expr.accept(self)
+        yield node.expr
         self.emit("print")
 
     def visit_delay_node(self, node):
-        delay_type = node.expr.accept(self)
+        delay_type = yield node.expr
         if delay_type != "int":
             raise Exception(f"Type Error: __delay expects 'int', got '{delay_type}'")
         self.emit("delay")
         
     def visit_clear_node(self, node):
-        clear_type = node.expr.accept(self)
+        clear_type = yield node.expr
         if clear_type != "colour":
             raise Exception(f"Type Error: __clear expects 'colour', got '{clear_type}'")
         self.emit("clear")
 
     def visit_write_node(self, node):
-        val_type = node.val_expr.accept(self)
-        y_type = node.y_expr.accept(self)
-        x_type = node.x_expr.accept(self)
+        val_type = yield node.val_expr
+        y_type = yield node.y_expr
+        x_type = yield node.x_expr
 
         if x_type != "int":
             raise Exception(f"Type Error: __write expects int for x, got '{x_type}'")
@@ -400,11 +410,11 @@ class CodeGenerator:
         
     def visit_write_box_node(self, node):
         
-        val_type = node.val_expr.accept(self)
-        h_type = node.h_expr.accept(self)
-        w_type = node.w_expr.accept(self)
-        y_type = node.y_expr.accept(self)
-        x_type = node.x_expr.accept(self)
+        val_type = yield node.val_expr
+        h_type = yield node.h_expr
+        w_type = yield node.w_expr
+        y_type = yield node.y_expr
+        x_type = yield node.x_expr
 
         for label, typ in zip(["x", "y", "width", "height"], [x_type, y_type, w_type, h_type]):
             if typ != "int":
@@ -419,7 +429,7 @@ class CodeGenerator:
         if self.current_return_type is None:
             raise Exception("Semantic Error: 'return' statement outside of function.")
 
-        expr_type = node.expr.accept(self)
+        expr_type = yield node.expr
         if expr_type != self.current_return_type:
             raise Exception(
                 f"Type Error: Return type '{expr_type}' does not match expected function return type '{self.current_return_type}'"
@@ -427,7 +437,7 @@ class CodeGenerator:
         self.emit("ret")
 
     def visit_if_node(self, node):
-        cond_type = node.condition_expr.accept(self)
+        cond_type = yield node.condition_expr
         if cond_type != "bool":
             raise Exception("Type Error: Condition in 'if' must be boolean")
 
@@ -441,7 +451,7 @@ class CodeGenerator:
 
             # Starts with the else block
             # due to the stack frame approach
-            node.else_block.accept(self)
+            yield node.else_block
 
             # Jump over else block
             self.emit("push #PC+1")  # Placeholder
@@ -454,7 +464,7 @@ class CodeGenerator:
             self.instructions[cjmp_index - 1] = f"push #PC+{len(self.instructions) - cjmp_index + 1}"
             
             # Emits the then block (first block in PARl)
-            node.then_block.accept(self)
+            yield node.then_block
 
             # Gets the number of instructions that
             # need to be skipped after unconditional jump
@@ -470,7 +480,7 @@ class CodeGenerator:
             self.emit("push #PC+1")  # Placeholder for jump target
             self.emit("jmp")
             jmp_index = len(self.instructions) - 1
-            node.then_block.accept(self)
+            yield node.then_block
             self.instructions[jmp_index - 1] = f"push #PC+{len(self.instructions) - jmp_index + 1}"
 
     # Used similar logic to if node
@@ -489,7 +499,7 @@ class CodeGenerator:
             # Emits the number of variables and oframe
             self.emit(f"push {count}")
             self.emit("oframe")
-            node.init.accept(self)
+            yield node.init
         else:
             # No declarations and opens a frame
             self.emit("push 0")
@@ -499,7 +509,7 @@ class CodeGenerator:
         cond_index = len(self.instructions)
 
         if node.condition:
-            cond_type = node.condition.accept(self)
+            cond_type = yield node.condition
             if cond_type != "bool":
                 raise Exception(f"Type Error: for-loop condition must be 'bool', got '{cond_type}'")
         else:
@@ -514,10 +524,10 @@ class CodeGenerator:
         self.emit("jmp")
         jmp_to_end_index = len(self.instructions) - 1
 
-        node.body.accept(self)
+        yield node.body
 
         if node.update:
-            node.update.accept(self)
+            yield node.update
 
         # Jumps back to condition
         self.emit(f"push #PC-{len(self.instructions) - cond_index}")
@@ -532,7 +542,7 @@ class CodeGenerator:
         # Marks the start of the loop
         loop_start_index = len(self.instructions)  
 
-        cond_type = node.condition.accept(self)
+        cond_type = yield node.condition
         if cond_type != "bool":
             raise Exception("Type Error: Condition in 'while' must be boolean")
 
@@ -545,7 +555,7 @@ class CodeGenerator:
         jmp_index = len(self.instructions) - 1
 
         # Emits the body of the loop
-        node.body.accept(self)
+        yield node.body
 
         # Find instruction number to jump back to the condition
         self.emit(f"push #PC-{len(self.instructions) - loop_start_index}")
@@ -558,7 +568,7 @@ class CodeGenerator:
         if len(self.symbol_table.scopes) != 2:
             raise Exception("Semantic Error: Functions must be declared in the global scope.")
         
-        self.symbol_table.declare(node.name, {
+        self.symbol_table.declare(node.symbol, {
                 'type': node.return_type,
                 'kind': 'function',
                 'params': node.params,
@@ -575,16 +585,16 @@ class CodeGenerator:
         # Enters a new scope for the function
         self.symbol_table.enter_scope()
 
-        for name, typ, size_expr in node.params:
+        for (name, typ, size_expr), symbol in zip(node.params, node.param_symbols):
             if isinstance(typ, str) and typ.endswith("[]"):
                 # Determine size from literal size expression (assumes ASTIntegerNode)
                 if isinstance(size_expr, ASTIntegerNode):
                     size = int(size_expr.value)
                 else:
                     raise Exception(f"Semantic Error: Array parameter '{name}' must have a constant size.")
-                self.symbol_table.declare(name, typ, size=size)
+                self.symbol_table.declare(symbol, typ, size=size)
             else:
-                self.symbol_table.declare(name, typ)
+                self.symbol_table.declare(symbol, typ)
 
         self.current_return_type = node.return_type
 
@@ -605,7 +615,7 @@ class CodeGenerator:
         # Avoid visit_block_node here to skip oframe/cframe
         # Uses alloc instead due to how it is seen in PArIR
         for stmt in node.body.stmts:
-            stmt.accept(self)
+            yield stmt
 
         # Closes the function scope
         self.symbol_table.exit_scope()
@@ -627,12 +637,15 @@ class CodeGenerator:
         self.emit("oframe")
 
         for stmt in node.stmts:
-            stmt.accept(self)
+            yield stmt
 
         self.emit("cframe")
         self.symbol_table.exit_scope()
 
     def visit_program_node(self, node):
+        self.symbol_table.symbols = node.symbols
+        self.source = node.source
+
         # Emit PArIR .main entry
         self.emit(".main")
         self.emit("push 4")
@@ -661,7 +674,7 @@ class CodeGenerator:
         self.emit("oframe")
 
         for stmt in node.stmts:
-            stmt.accept(self)
+            yield stmt
 
         self.emit("cframe")
         self.symbol_table.exit_scope()
@@ -1,3 +1,4 @@
+import sys
 from parser import Parser
 from code_generator import CodeGenerator
 
@@ -460,3 +461,20 @@ for i, program in enumerate(test_inputs):
     except Exception as e:
         print(f"Error during parsing/codegen: {e}")
 
+# Nesting far deeper than the recursion limit, including counting the locals of nested blocks in a function
+print("\n=== Deep Nesting ===")
+depth = 5 * sys.getrecursionlimit()
+deep_programs = {
+    "while loops": "let x : int = 0;" + "while (true) {" * depth + "x = 1;" + "}" * depth,
+    "function blocks": "fun f() -> int {" + "if (true) { let y : int = 1;" * depth + "}" * depth + "return 0; }",
+    "arithmetic": "__print " + "(1 + " * depth + "1" + ")" * depth + ";",
+}
+for name, program in deep_programs.items():
+    try:
+        parser = Parser(program)
+        parser.Parse()
+        codegen = CodeGenerator()
+        parser.ASTroot.accept(codegen)
+        print(f"{depth} nested {name}: {len(codegen.instructions)} instructions")
+    except Exception as e:
+        print(f"Error during parsing/codegen: {e}")
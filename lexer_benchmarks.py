@@ -0,0 +1,593 @@
+import contextlib
+import os
+import pathlib
+import pickle
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import astnodes
+import lexer
+from lexer import Lexer, TokenType, attach_token_buffer
+from parser import Parser, reparse
+from parse_cache import ParseCache
+from semantic_analyzer import SemanticAnalyzer
+from symbol_table import SymbolTable
+
+# Builds a large synthetic PArL program out of statement templates
+# A fixed seed keeps the corpus identical between runs so timings can be compared
+def generate_corpus(n_functions=400, seed=2000):
+    rng = random.Random(seed)
+    parts = []
+    for f in range(n_functions):
+        parts.append(f"// helper number {f}\n")
+        parts.append(f"fun func_{f}(a : int, b : float, c : colour) -> int {{\n")
+        for s in range(rng.randint(3, 8)):
+            x = rng.randint(0, 99999)
+            choice = rng.randint(0, 6)
+            if choice == 0:
+                parts.append(f"    let v{s} : int = a * {x} + (b as int) - {x % 7};\n")
+            elif choice == 1:
+                parts.append(f"    let f{s} : float = {x}.{x % 1000} / 3.25;\n")
+            elif choice == 2:
+                parts.append(f"    __write_box a, {x % 36}, 2, 2, #{x % 0xFFFFFF:06x};\n")
+            elif choice == 3:
+                parts.append(f"    /* block comment {x}\n       spanning two lines */\n")
+            elif choice == 4:
+                parts.append(f"    if (a >= {x} and not (b != 0.5)) {{ __print a; }} else {{ __delay {x % 100}; }}\n")
+            elif choice == 5:
+                parts.append(f"    for (let i : int = 0; i <= {x}; i = i + 1) {{ __write i, a, c; }}\n")
+            else:
+                parts.append(f"    let long_identifier_name_{s}_{x} : bool = true == false; // trailing\n")
+        parts.append("    return a;\n}\n\n")
+    return "".join(parts)
+
+# Lexes the source with the given lexer and returns the token count and elapsed seconds
+def time_lexer(lexer, src, repeats=3):
+    best = None
+    count = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        count = 0
+        for _ in lexer.iter_tokens(src):
+            count += 1
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+# Compares the table interpreting DFA with the compiled integer-table scanner
+def bench_engines(src, engines):
+    print(f"Corpus: {len(src)} characters")
+    baseline = None
+    for engine in engines:
+        count, elapsed = time_lexer(Lexer(engine), src)
+        rate = count / elapsed
+        baseline = baseline or rate
+        print(f"  {engine:>10}: {count} tokens in {elapsed:.3f}s => {rate:,.0f} tokens/sec ({rate / baseline:.1f}x)")
+    if lexer.numpy is None:
+        print(f"  {'numpy':>10}: skipped: numpy not installed")
+
+# Compares the table-driven NextToken loop with the scanner generated from the DFA
+def bench_generated(src):
+    lexer = Lexer("generated")
+
+    start = time.perf_counter()
+    idx = 0
+    count = 0
+    while True:
+        token, lexeme = lexer.NextToken(src, idx)
+        count += 1
+        if token.type == TokenType.end or token.type == TokenType.error:
+            break
+        idx += len(lexeme)
+    table_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    idx = 0
+    while True:
+        token_type, end = lexer.ScanGenerated(src, idx)
+        if end == idx:
+            break
+        idx = end
+    generated_time = time.perf_counter() - start
+    print(f"  NextToken:         {count} tokens in {table_time:.3f}s")
+    print(f"  generated scanner: {count} tokens in {generated_time:.3f}s ({table_time / generated_time:.1f}x)")
+
+# Token with a per-instance __dict__ and its own copy of the lexeme, as tokens were stored before
+# offsets into a shared source were introduced, kept as the reference for the memory benchmark
+class DictToken:
+    def __init__(self, t, l):
+        self.type = t
+        self.lexeme = l
+
+# Measures the memory held by a list of all the tokens of the source
+def measure_tokens(make_tokens):
+    tracemalloc.start()
+    tokens = make_tokens()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(tokens), size
+
+# Compares the bytes per token of slotted offset tokens against dict tokens with copied lexemes
+def bench_token_memory(src):
+    lexer = Lexer("compiled")
+    count, slotted = measure_tokens(lambda: list(lexer.iter_tokens(src)))
+    _, copied = measure_tokens(lambda: [DictToken(t.type, "".join(list(t.lexeme))) for t in lexer.iter_tokens(src)])
+    print(f"  dict tokens with copied lexemes: {copied / count:.0f} bytes/token")
+    print(f"  slotted tokens with offsets:     {slotted / count:.0f} bytes/token ({slotted / copied:.0%} of the dict tokens)")
+
+# Lexes single huge tokens of doubling size, linear lexing keeps the time per character flat
+def bench_pathological(engines, sizes=(1 << 17, 1 << 18, 1 << 19, 1 << 20)):
+    cases = {
+        "block comment": lambda n: "/*" + "x" * n + "*/",
+        "line comment": lambda n: "//" + "x" * n + "\n",
+        "identifier": lambda n: "x" * n,
+    }
+    for name, make in cases.items():
+        for engine in engines:
+            timings = []
+            for n in sizes:
+                count, elapsed = time_lexer(Lexer(engine), make(n), repeats=1)
+                timings.append(f"{n >> 10}K: {elapsed * 1e9 / n:.1f} ns/char")
+            print(f"  {name:>13} {engine:>10}: " + ", ".join(timings))
+
+# Compares token lists with and without trivia tokens, and walking them as the parser does
+# With trivia every advance has to test the type of the token against the trivia types,
+# without them it is a single index increment
+def bench_trivia(src):
+    lexer = Lexer("compiled")
+    trivia_types = Lexer.trivia_types
+    for trivia in ("keep", "skip"):
+        count, size = measure_tokens(lambda: lexer.GenerateTokensNoPrinting(src, trivia))
+        tokens = lexer.GenerateTokensNoPrinting(src, trivia)
+        start = time.perf_counter()
+        index = -1
+        significant = 0
+        while index < count - 1:
+            index += 1
+            if trivia == "keep":
+                while tokens[index].type in trivia_types:
+                    index += 1
+            significant += 1
+        elapsed = time.perf_counter() - start
+        print(f"  {trivia:>4} trivia: {count} tokens in {size / 1024:.0f}KB, advancing over {significant} tokens in {elapsed * 1000:.1f}ms")
+
+    start = time.perf_counter()
+    Parser(src).Parse()
+    print(f"  Parser(...).Parse(): {(time.perf_counter() - start) * 1000:.0f}ms")
+
+# Compares the peak memory of parsing with the tokens pulled from the lexer through the parser's ring buffer
+# against parsing a full token list, which stays alive until the parser is done
+def bench_parser_memory(src):
+    lexer = Lexer()
+    ways = {
+        "token list": lambda: Parser(src, lexer.GenerateTokensNoPrinting(src, "skip")),
+        "pulled tokens": lambda: Parser(src),
+    }
+    for name, make_parser in ways.items():
+        tracemalloc.start()
+        parser = make_parser()
+        parser.Parse()
+        ast_size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del parser
+        print(f"  {name:>13}: peak {peak / 1024:.0f}KB, {ast_size / 1024:.0f}KB held after parsing")
+
+# Measures the memory the spans of the nodes add to a parsed tree, their three slots from the size of a node and
+# the ints and anchors which only the spans hold by deleting the spans of every node
+def bench_span_memory(src):
+    tracemalloc.start()
+    parser = Parser(src)
+    parser.Parse()
+    program = parser.ASTroot
+    del parser
+    tree, _ = tracemalloc.get_traced_memory()
+    nodes = [program]
+    for node in nodes:
+        nodes.extend(astnodes.child_nodes(node))
+    before, _ = tracemalloc.get_traced_memory()
+    for node in nodes:
+        del node.anchor, node.offset, node.length
+    held = before - tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    slots = len(nodes) * (astnodes.ASTNode.__basicsize__ - object.__basicsize__)
+    print(f"  {len(nodes)} nodes in {tree / 1024:.0f}KB, spans take {slots / len(nodes):.0f} bytes of slots "
+          f"and {held / len(nodes):.0f} bytes of ints and anchors per node, {(slots + held) / tree:.0%} of the tree")
+
+# Parses the pre-lexed tokens of the corpus and reports the parser's throughput in tokens per second
+def bench_parse(src, repeats=5):
+    tokens = Lexer("compiled").GenerateTokensNoPrinting(src, "skip")
+    best = None
+    for _ in range(repeats):
+        parser = Parser(src, tokens)
+        start = time.perf_counter()
+        parser.Parse()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  Parse(): {len(tokens)} tokens in {best * 1000:.0f}ms => {len(tokens) / best:,.0f} tokens/sec")
+
+# Times updating the AST after a one character edit in the middle function, parsing the new source in full
+# against reparse, which relexes the edited region and parses again only the block enclosing it
+def bench_reparse(src, repeats=20):
+    offset = src.index("return a;", len(src) // 2)
+    edits = [src[:offset] + f"__print {i % 10}; " + src[offset:] for i in range(2)]
+
+    start = time.perf_counter()
+    for i in range(repeats):
+        Parser(edits[i % 2]).Parse()
+    full = (time.perf_counter() - start) / repeats
+
+    tokens = list(Lexer().iter_tokens(edits[0], "skip"))
+    parser = Parser(edits[0], tokens)
+    parser.Parse()
+    program = parser.ASTroot
+    functions = list(program.stmts)
+    digit = offset + len("__print ")
+    start = time.perf_counter()
+    for i in range(repeats):
+        program = reparse(program, tokens, digit, 1, str((i + 1) % 10))
+    incremental = (time.perf_counter() - start) / repeats
+    kept = sum(node is old for node, old in zip(program.stmts, functions))
+
+    print(f"  full parse: {full * 1000:.1f}ms per edit")
+    print(f"  reparse:    {incremental * 1000:.2f}ms per edit ({full / incremental:.0f}x), "
+          f"{kept}/{len(functions)} top-level nodes kept")
+
+# Times Parse() without a cache, with an empty cache, which parses and stores the program, and with the program
+# already cached, which only reads and decodes it
+def bench_parse_cache(src, repeats=5):
+    with tempfile.TemporaryDirectory() as directory:
+        timings = {"no cache": None, "cold cache": None, "warm cache": None}
+        for _ in range(repeats):
+            for name, cache in (("no cache", None), ("cold cache", ParseCache(directory)), ("warm cache", directory)):
+                if name == "cold cache":
+                    for entry in os.listdir(directory):
+                        os.remove(os.path.join(directory, entry))
+                parser = Parser(src, cache=cache)
+                start = time.perf_counter()
+                parser.Parse()
+                elapsed = time.perf_counter() - start
+                timings[name] = elapsed if timings[name] is None else min(timings[name], elapsed)
+        count, size = ParseCache(directory).size()
+    for name, elapsed in timings.items():
+        print(f"  {name:10}: {elapsed * 1000:.1f}ms")
+    print(f"  warm cache is {timings['no cache'] / timings['warm cache']:.1f}x faster than parsing, "
+          f"entry {size // 1024}KB for {len(src) // 1024}KB of source")
+
+# Times a full Parse() against one with lazy_bodies, which only parses the function signatures, and then the
+# time to parse every body as a pass over the whole program does on first use
+def bench_lazy_bodies(src, repeats=3):
+    timings = {"eager": None, "lazy": None, "lazy bodies": None}
+    for _ in range(repeats):
+        for lazy_bodies in (False, True):
+            parser = Parser(src, lazy_bodies=lazy_bodies)
+            start = time.perf_counter()
+            parser.Parse()
+            elapsed = time.perf_counter() - start
+            name = "lazy" if lazy_bodies else "eager"
+            timings[name] = elapsed if timings[name] is None else min(timings[name], elapsed)
+        functions = [stmt for stmt in parser.ASTroot.stmts if isinstance(stmt, astnodes.ASTFunctionDeclNode)]
+        start = time.perf_counter()
+        for function in functions:
+            function.body
+        elapsed = time.perf_counter() - start
+        timings["lazy bodies"] = elapsed if timings["lazy bodies"] is None else min(timings["lazy bodies"], elapsed)
+    for name, elapsed in timings.items():
+        print(f"  {name:11}: {elapsed * 1000:.1f}ms")
+    print(f"  signatures only is {timings['eager'] / timings['lazy']:.1f}x faster than parsing, "
+          f"{len(functions)} function bodies skipped")
+
+# Parser with the recursive descent chain ParseExpression -> ParseSimpleExpression -> ParseTerm -> ParseFactor
+# which the precedence climbing ParseExpression replaced, kept as the reference for the expression benchmark
+class ChainParser(Parser):
+    # ⟨Term⟩
+    def ParseTerm(self):
+        left = yield self.ParseFactor()
+
+        # ⟨MultiplicativeOp⟩
+        while self.crtToken.type in [
+            TokenType.multiply,
+            TokenType.slash,
+            TokenType.kw_and
+        ]:
+            op = self.crtToken.lexeme
+            self.NextToken()
+            right = yield self.ParseFactor()
+            left = self.Spanned(astnodes.ASTBinaryOpNode(op, left, right), left.start, right.end)
+
+        return left
+
+    # ⟨SimpleExpr⟩
+    def ParseSimpleExpression(self):
+        left = yield self.ParseTerm()
+
+        # ⟨AdditiveOp⟩
+        while self.crtToken.type in [
+            TokenType.plus,
+            TokenType.minus,
+            TokenType.kw_or
+        ]:
+            op = self.crtToken.lexeme
+            self.NextToken()
+            right = yield self.ParseTerm()
+            left = self.Spanned(astnodes.ASTBinaryOpNode(op, left, right), left.start, right.end)
+
+        return left
+    
+    # ⟨Expr⟩
+    def ParseExpression(self):
+        left = yield self.ParseSimpleExpression()
+
+        # ⟨RelationalOp⟩
+        if self.crtToken.type in [
+            TokenType.less,
+            TokenType.greater,
+            TokenType.equal_equal,
+            TokenType.not_equal,
+            TokenType.less_equal,
+            TokenType.greater_equal
+        ]:
+            op = self.crtToken.lexeme
+            self.NextToken()
+            right = yield self.ParseSimpleExpression()
+            left = self.Spanned(astnodes.ASTBinaryOpNode(op, left, right), left.start, right.end)
+
+        if self.crtToken.type == TokenType.kw_as:
+            self.NextToken()
+            end = self.crtToken.end
+            cast_type = self.ParseType()
+            left = self.Spanned(astnodes.ASTCastNode(left, cast_type), left.start, end)
+
+        return left
+
+# Builds a long arithmetic expression over all the precedence levels of the binary operators
+def generate_expression(n_operands, seed=2000):
+    rng = random.Random(seed)
+    operators = ["*", "/", "+", "-", "and", "or"]
+    parts = [str(rng.randint(0, 999))]
+    for _ in range(n_operands - 1):
+        parts.append(rng.choice(operators))
+        parts.append(rng.choice(["x", str(rng.randint(0, 999)), "(y * 2)", "1.5"]))
+    return " ".join(parts)
+
+# Compares parsing long expressions with the recursive descent chain against precedence climbing
+def bench_expressions(n_operands=2000, statements=50, repeats=3):
+    src = "".join(f"__print {generate_expression(n_operands, seed)} < {seed};\n" for seed in range(statements))
+    # The tokens are lexed beforehand so only the parsing is timed
+    tokens = Lexer("compiled").GenerateTokensNoPrinting(src, "skip")
+    baseline = None
+    for name, parser_class in (("descent chain", ChainParser), ("precedence climbing", Parser)):
+        best = None
+        for _ in range(repeats):
+            parser = parser_class(src, tokens)
+            start = time.perf_counter()
+            parser.Parse()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        baseline = baseline or best
+        print(f"  {name:>19}: {statements} expressions of {n_operands} operands in {best * 1000:.0f}ms ({baseline / best:.1f}x)")
+
+# Parses and analyses programs nested to growing depths, with the explicit stacks of the parser and the visitors
+# The time per nesting level grows with the depth while the garbage collector runs, as its full collections walk
+# every node and frame kept alive so far, and stays flat with it paused by astnodes.paused_gc
+def bench_nesting(depths=(1000, 4000, 16000, 64000)):
+    lexer = Lexer("compiled")
+    cases = {
+        "parentheses": lambda n: "let x : int = " + "(" * n + "1" + ")" * n + ";",
+        "if blocks": lambda n: "if (true) {" * n + "__print 1;" + "}" * n,
+    }
+    for name, make in cases.items():
+        for pause_gc in (False, True):
+            timings = []
+            for n in depths:
+                src = make(n)
+                tokens = lexer.GenerateTokensNoPrinting(src, "skip")
+                start = time.perf_counter()
+                with astnodes.paused_gc() if pause_gc else contextlib.nullcontext():
+                    parser = Parser(src, tokens)
+                    parser.Parse()
+                    parser.ASTroot.accept(SemanticAnalyzer())
+                timings.append(f"{n}: {(time.perf_counter() - start) * 1e6 / n:.1f}us/level")
+            label = f"{name}, {'GC paused' if pause_gc else 'GC running'}"
+            print(f"  {label:>25}: " + ", ".join(timings))
+
+# Compares SymbolTable lookups, which index the visible entries by interned id, against the walk over the
+# scopes from the innermost which looking up by name needs, with the names declared in the outermost scope,
+# and counts the identifier strings the AST holds against the distinct names behind them
+def bench_symbols(src, scopes=8, repeats=20):
+    parser = Parser(src)
+    parser.Parse()
+    symbols = parser.ASTroot.symbols
+    names = [token.lexeme for token in parser.lexer.iter_tokens(src, "skip") if token.type == TokenType.identifier]
+    ids = [symbols.ids[name] for name in names]
+
+    name_scopes = [{name: {} for name in set(names)}] + [{} for _ in range(scopes - 1)]
+    def walk(name):
+        for level in range(len(name_scopes) - 1, -1, -1):
+            if name in name_scopes[level]:
+                return name_scopes[level][name]
+
+    table = SymbolTable(symbols)
+    for symbol in set(ids):
+        table.declare(symbol, "int")
+    for _ in range(scopes - 1):
+        table.enter_scope()
+
+    for label, lookup, keys in (("names", walk, names), ("ids", table.lookup, ids)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for key in keys:
+                lookup(key)
+        elapsed = time.perf_counter() - start
+        print(f"  lookup by {label:>5}: {elapsed * 1e9 / (repeats * len(keys)):.0f}ns through {scopes} scopes")
+
+    print(f"  {len(names)} identifier occurrences share {len(set(map(id, symbols.names)))} interned name strings")
+
+# Compares what handing the tokens of a source to another process costs: pickling the list of tokens,
+# pickling the columnar TokenBuffer, or attaching the buffer from shared memory by name
+def bench_token_buffer(src):
+    lexer = Lexer("compiled")
+    tokens = lexer.GenerateTokensNoPrinting(src, "skip")
+    buffer = lexer.token_buffer(src)
+    shared = buffer.share()
+    ways = {
+        "pickled tokens": (lambda: pickle.loads(pickle.dumps(tokens, pickle.HIGHEST_PROTOCOL)), len(pickle.dumps(tokens, pickle.HIGHEST_PROTOCOL))),
+        "pickled buffer": (lambda: pickle.loads(pickle.dumps(buffer, pickle.HIGHEST_PROTOCOL)), len(pickle.dumps(buffer, pickle.HIGHEST_PROTOCOL))),
+        "shared buffer": (lambda: attach_token_buffer(shared.shared.name), len(shared.shared.name)),
+    }
+    for name, (transfer, size) in ways.items():
+        start = time.perf_counter()
+        received = transfer()
+        elapsed = time.perf_counter() - start
+        print(f"  {name:>14}: {len(received)} tokens, {size / 1024:.0f}KB sent, {elapsed * 1000:.1f}ms to send and receive")
+        if name == "shared buffer":
+            received.close()
+    shared.close()
+    shared.unlink()
+
+# Lexes one large source with lex_parallel for a growing number of worker processes
+# The speed-up is bounded by the cores of the machine and by sending the chunks and token arrays between processes
+def bench_parallel(src, worker_counts=(1, 2, 4, 8)):
+    lexer = Lexer("compiled")
+    print(f"Corpus: {len(src)} characters, {os.cpu_count()} cores")
+    serial = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        tokens = lexer.lex_parallel(src, workers, min_chunk=1)
+        elapsed = time.perf_counter() - start
+        serial = serial or elapsed
+        print(f"  {workers} workers: {len(tokens)} tokens in {elapsed:.3f}s ({serial / elapsed:.1f}x)")
+
+# Times Parse() over the top-level statements split between worker processes against one process
+# Both lex with the compiled engine, the serial parse from a token stream and the parallel one into a TokenBuffer
+# None is the number Parse picks from the cores of the machine, which is a serial parse below parallel_min_cores
+def bench_parse_parallel(src, worker_counts=(1, 2, 4, 8, None)):
+    print(f"Corpus: {len(src)} characters, {os.cpu_count()} cores")
+    serial = None
+    for workers in worker_counts:
+        # The tokens are only used by a serial parse, a parallel one lexes the source itself
+        if workers == 1 or workers is None:
+            parser = Parser(src, Lexer("compiled").iter_tokens(src, "skip"))
+        else:
+            parser = Parser(src)
+            parser.parallel_min_chars = 1
+        start = time.perf_counter()
+        parser.Parse(workers)
+        elapsed = time.perf_counter() - start
+        serial = serial or elapsed
+        print(f"  {workers} workers: {len(parser.ASTroot.stmts)} statements in {elapsed:.3f}s ({serial / elapsed:.1f}x)")
+
+# Compares reading and decoding a source file up front, by hand or by iter_tokens, against lexing the memory-mapped bytes
+# The first token shows the start-up latency and the full scan the overall throughput
+def bench_file(src):
+    lexer = Lexer("compiled")
+    with tempfile.TemporaryDirectory() as directory:
+        path = pathlib.Path(directory) / "corpus.parl"
+        path.write_text(src, encoding="utf-8")
+        print(f"File: {os.path.getsize(path)} bytes")
+        ways = {
+            "read+decode": lambda: lexer.iter_tokens(path.read_text(encoding="utf-8")),
+            "read path": lambda: lexer.iter_tokens(path),
+            "mmap": lambda: lexer.iter_tokens(path, mapped=True),
+        }
+        for name, make_tokens in ways.items():
+            start = time.perf_counter()
+            next(make_tokens())
+            first = time.perf_counter() - start
+            start = time.perf_counter()
+            count = sum(1 for _ in make_tokens())
+            elapsed = time.perf_counter() - start
+            print(f"  {name:>11}: first token after {first * 1e6:.0f}us, {count} tokens in {elapsed:.3f}s")
+
+# Times Parser construction on a small program, which creates a Lexer and lexes the source each time
+# Clearing Lexer.shared_tables before every construction rebuilds the tables as every Lexer used to
+def bench_parser_construction(program="let x : int = 5;", repeats=2000):
+    def construct(rebuild):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            if rebuild:
+                Lexer.shared_tables = None
+            Parser(program)
+        return (time.perf_counter() - start) * 1e6 / repeats
+
+    rebuilt = construct(True)
+    shared = construct(False)
+    print(f"  rebuilt tables: {rebuilt:.1f}us per Parser")
+    print(f"  shared tables:  {shared:.1f}us per Parser ({rebuilt / shared:.1f}x)")
+
+    # First Lexer of a process, building the tables against loading them from a snapshot
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tables.marshal")
+        lexer.write_tables_snapshot(path)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            Lexer.shared_tables = None
+            Lexer()
+        built = (time.perf_counter() - start) * 1e6 / repeats
+        start = time.perf_counter()
+        for _ in range(repeats):
+            lexer.load_tables_snapshot(path)
+        loaded = (time.perf_counter() - start) * 1e6 / repeats
+    print(f"  first Lexer: {built:.1f}us building the tables, {loaded:.1f}us loading the snapshot")
+
+if __name__ == "__main__":
+    n_functions = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    src = generate_corpus(n_functions)
+
+    print("--- Lexer engines ---")
+    bench_engines(src, Lexer.engines)
+
+    print("--- Generated scanner ---")
+    bench_generated(src)
+
+    print("--- Token memory ---")
+    bench_token_memory(src)
+
+    print("--- Trivia tokens ---")
+    bench_trivia(src)
+
+    print("--- Parser throughput ---")
+    bench_parse(src)
+
+    print("--- Parse cache ---")
+    bench_parse_cache(src)
+
+    print("--- Incremental reparse ---")
+    bench_reparse(src)
+
+    print("--- Lazy function bodies ---")
+    bench_lazy_bodies(src)
+
+    print("--- Expression parsing ---")
+    bench_expressions()
+    bench_expressions(n_operands=1, statements=20000)
+
+    print("--- Nesting depth ---")
+    bench_nesting()
+
+    print("--- Parser memory ---")
+    bench_parser_memory(src)
+    bench_span_memory(src)
+
+    print("--- Interned identifiers ---")
+    bench_symbols(src)
+
+    print("--- Token buffers ---")
+    bench_token_buffer(src)
+
+    print("--- Parser construction ---")
+    bench_parser_construction()
+
+    print("--- Parallel lexing ---")
+    bench_parallel(generate_corpus(n_functions * 10))
+
+    print("--- Parallel parsing ---")
+    bench_parse_parallel(generate_corpus(n_functions * 10))
+
+    print("--- Source files ---")
+    bench_file(src)
+
+    print("--- Pathological inputs ---")
+    bench_pathological(Lexer.engines)
@@ -1,4 +1,13 @@
-from lexer import Lexer
+import contextlib
+import io
+import pathlib
+import random
+import tempfile
+from astnodes import PrintNodesVisitor
+import lexer as lex
+from lexer import Lexer, attach_token_buffer
+from parser import Parser
+from lexer_benchmarks import generate_corpus
 
 if __name__ == "__main__":
     test_inputs = [
@@ -45,4 +54,191 @@ if __name__ == "__main__":
     # Loops through each test input
     for i, code in enumerate(test_inputs):
         print(f"\n--- Test {i+1} ---")
-        tokens = lexer.GenerateTokens(code)
\ No newline at end of file
+        tokens = lexer.GenerateTokens(code)
+
+    # Streaming: tokens are pulled one at a time from a text stream, including a block comment spanning lines
+    print("\n--- Streaming Test ---")
+    stream = io.StringIO("let x : int = 5; /* spans\n two lines */\nx = x + 1; // done\n")
+    for token in lexer.iter_tokens(stream):
+        print(f"{token.line}:{token.column}", token.type, repr(token.lexeme))
+
+    # Differential test: every engine must produce the same tokens as the table interpreting DFA
+    # on the test inputs, the benchmark corpus and random soups of token fragments
+    print("\n--- Engine Differential Test ---")
+    fragments = ["/*", "*/", "**/", "*", "/", "//", "\n", " ", "\t", "\r", "#", "#a1B2c3", "#12345", "A", "f", "x",
+                 "_", "__", "__print", "__write_box", "__w2", "1", "23", "4.", "5.6", "7.8x", "9.1x+2", "3.2e5",
+                 "=", "==", "!", "!=", "<", "<=", ">", ">=", "-", "->", "+", ";", "(", ")", "{", "}", "[", "]",
+                 ":", ",", ".", "let", "true", "int", "é", "²", "@", "\x0b"]
+    rng = random.Random(7)
+    corpus = test_inputs + [generate_corpus(20)]
+    corpus += ["".join(rng.choice(fragments) for _ in range(rng.randint(0, 30))) for _ in range(3000)]
+    for engine in Lexer.engines:
+        other_lexer = Lexer(engine)
+        mismatches = 0
+        for code in corpus:
+            expected = [(t.type, t.lexeme) for t in lexer.iter_tokens(code)]
+            actual = [(t.type, t.lexeme) for t in other_lexer.iter_tokens(code)]
+            if expected != actual:
+                mismatches += 1
+                print(f"MISMATCH ({engine}) on {code!r}")
+        print(f"{engine}: {len(corpus) - mismatches}/{len(corpus)} inputs match")
+
+    # Incremental relexing: after every random edit the patched tokens must equal a full relex of the new source,
+    # both for token lists with trivia and for the trivia-free ones the parser reads
+    print("\n--- Incremental Relex Test ---")
+    edits = ["", "x", "1", " ", "\n", "/*", "*/", "*", "//", "#a1", "=", "__print"]
+    for trivia in ("keep", "skip"):
+        source = generate_corpus(5)
+        tokens = list(lexer.iter_tokens(source, trivia))
+        mismatches = 0
+        for _ in range(500):
+            offset = rng.randint(0, len(source))
+            deleted = rng.randint(0, min(3, len(source) - offset))
+            inserted = rng.choice(edits)
+            source = source[:offset] + inserted + source[offset + deleted:]
+            tokens = lexer.relex(tokens, offset, deleted, inserted, trivia)
+            expected = [(t.type, t.start, t.end) for t in lexer.iter_tokens(source, trivia)]
+            if expected != [(t.type, t.start, t.end) for t in tokens]:
+                mismatches += 1
+                tokens = list(lexer.iter_tokens(source, trivia))
+        print(f"{trivia}: {500 - mismatches}/500 edits match a full relex")
+
+    print("\n--- Memory-Mapped File Test ---")
+    with tempfile.TemporaryDirectory() as directory:
+        path = pathlib.Path(directory) / "program.parl"
+        sources = test_inputs + [generate_corpus(20), "let café : int = 1; // naïve\n__print café;"]
+        mismatches = 0
+        for source in sources:
+            path.write_bytes(source.encode("utf-8"))
+            expected = [(t.type, t.lexeme, t.line, t.column) for t in lexer.iter_tokens(source)]
+            if expected != [(t.type, t.lexeme, t.line, t.column) for t in lexer.iter_tokens(path, mapped=True)]:
+                mismatches += 1
+        print(f"{len(sources) - mismatches}/{len(sources)} files lex the same as their decoded text")
+        path.write_text(sources[-1], encoding="utf-8")
+        read = [(t.type, t.start, t.end) for t in lexer.iter_tokens(path)]
+        print("read file:", "same as its text" if read == [(t.type, t.start, t.end) for t in lexer.iter_tokens(sources[-1])] else "mismatch")
+
+    print("\n--- Trivia-Free Token Test ---")
+    sources = test_inputs + [generate_corpus(20)]
+    for engine in Lexer.engines:
+        trivia_lexer = Lexer(engine)
+        mismatches = 0
+        for source in sources:
+            tokens = list(trivia_lexer.iter_tokens(source))
+            expected = [(t.type, t.start, t.end) for t in tokens if t.type not in Lexer.trivia_types]
+            skipped = list(trivia_lexer.iter_tokens(source, "skip"))
+            spanned = list(trivia_lexer.iter_tokens(source, "span"))
+            # The spans before the significant tokens must cover exactly the trivia tokens
+            trivia = "".join(t.lexeme for t in tokens if t.type in Lexer.trivia_types)
+            if (expected != [(t.type, t.start, t.end) for t in skipped]
+                    or expected != [(t.type, t.start, t.end) for t in spanned]
+                    or trivia != "".join(source[t.trivia_start:t.start] for t in spanned)):
+                mismatches += 1
+        print(f"{engine}: {len(sources) - mismatches}/{len(sources)} inputs skip trivia correctly")
+
+    print("\n--- Error Recovery Test ---")
+    # Every error is reported with its position and the lexing carries on after it
+    source = "let x : int = @;\nlet _ : int = 5 $$ 3;\n__bogus x = ` 1;\n"
+    tokens, errors = lexer.GenerateTokensWithErrors(source, "skip")
+    for error in errors:
+        print(f"{error.line}:{error.column}", error.type, repr(error.lexeme))
+    print(len(tokens), "tokens, ending with", tokens[-1].type)
+
+    # The tokens and the errors together must cover the whole input, with the same result from every engine
+    mismatches = 0
+    sources = test_inputs + [generate_corpus(5) + "@ é $ _ __nope `", source]
+    for code in sources:
+        results = []
+        for engine in Lexer.engines:
+            tokens, errors = Lexer(engine).GenerateTokensWithErrors(code)
+            results.append(([(t.type, t.start, t.end) for t in tokens], [(t.start, t.end) for t in errors]))
+            covered = "".join(t.lexeme for t in sorted(tokens + errors, key=lambda t: t.start))
+            if covered != code:
+                mismatches += 1
+        if any(result != results[0] for result in results):
+            mismatches += 1
+    print(f"{len(sources) - mismatches}/{len(sources)} inputs recover consistently")
+
+    print("\n--- Parallel Lexing Test ---")
+    # Chunks are split after newlines outside block comments, so stitching them back must give the serial tokens
+    source = generate_corpus(40) + "/* a comment\n\n spanning // lines /*\n*/ x /* ** */\n" * 20 + generate_corpus(40)
+    serial = [(t.type, t.start, t.end) for t in lexer.iter_tokens(source)]
+    for workers in (2, 3, 5):
+        parallel = [(t.type, t.start, t.end) for t in lexer.lex_parallel(source, workers, min_chunk=1)]
+        print(f"{workers} workers:", "matches serial lexing" if parallel == serial else "differs from serial lexing")
+
+    print("\n--- Token Buffer Test ---")
+    # The columnar buffer, and the same buffer attached from shared memory, must give the tokens of iter_tokens
+    # and let the parser build the same AST as parsing the source
+    source = generate_corpus(20)
+    expected = [(t.type, t.start, t.end, t.lexeme) for t in lexer.iter_tokens(source, "skip")]
+    buffer = lexer.token_buffer(source)
+    shared = buffer.share()
+    attached = attach_token_buffer(shared.shared.name)
+    for name, tokens in (("array buffer", buffer), ("shared buffer", attached)):
+        columns = [(t.type, t.start, t.end, t.lexeme) for t in (tokens[i] for i in range(len(tokens)))]
+        print(f"{name}:", "matches iter_tokens" if columns == expected else "differs from iter_tokens")
+    printed = []
+    for tokens in (None, attached):
+        parser = Parser(source, tokens)
+        parser.Parse()
+        with contextlib.redirect_stdout(io.StringIO()) as tree:
+            parser.ASTroot.accept(PrintNodesVisitor())
+        printed.append(tree.getvalue())
+    print("parsing the shared buffer:", "builds the same AST" if printed[0] == printed[1] else "builds a different AST")
+    attached.close()
+    shared.close()
+    shared.unlink()
+
+    # Tables snapshot: a snapshot of the right version whose tables are damaged is not loaded, so the first Lexer
+    # builds the tables and lexes as it would without a snapshot
+    print("\n--- Tables Snapshot Test ---")
+    tables = Lexer.shared_tables
+    Tx, ascii_classes, final_types = tables
+    type_values = tuple(t.value if t else 0 for t in final_types)
+    expected = [(t.type, t.start, t.end) for t in Lexer("compiled").iter_tokens(generate_corpus(5))]
+    damaged = {
+        "unknown token type": (Tx, ascii_classes, (999,) + type_values[1:]),
+        "row of strings": ((tuple(str(n) for n in Tx[0]),) + Tx[1:], ascii_classes, type_values),
+        "short row": ((Tx[0][:-1],) + Tx[1:], ascii_classes, type_values),
+        "state out of range": (((Lexer.rows,) + Tx[0][1:],) + Tx[1:], ascii_classes, type_values),
+        "column out of range": (Tx, (Lexer.cols,) + ascii_classes[1:], type_values),
+        "rows as a list": (list(Tx), ascii_classes, type_values),
+        "missing token types": (Tx, ascii_classes, type_values[:-1]),
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(pathlib.Path(directory) / "lexer_tables.marshal")
+        for name, (rows, classes, types) in damaged.items():
+            with open(path, "wb") as file:
+                file.write(lex.marshal.dumps((Lexer.tables_version, rows, classes, types)))
+            Lexer.shared_tables = None
+            loaded = lex.load_tables_snapshot(path)
+            tokens = [(t.type, t.start, t.end) for t in Lexer("compiled").iter_tokens(generate_corpus(5))]
+            print(f"{name}: {'loaded' if loaded else 'rebuilt'}, lexes {'the same' if tokens == expected else 'differently'}")
+        lex.write_tables_snapshot(path)
+        Lexer.shared_tables = None
+        print("written snapshot:", "loaded" if lex.load_tables_snapshot(path) else "rebuilt")
+    Lexer.shared_tables = tables
+
+    # NumPy engine: long runs of one class of characters are skipped at once, which the random soups of the
+    # differential test rarely reach, so runs of every kind are lexed in every mode against the DFA
+    print("\n--- NumPy Engine Test ---")
+    if lex.numpy is None:
+        print("numpy engine: skipped: numpy not installed")
+    else:
+        numpy_lexer = Lexer("numpy")
+        runs = ["x" * 5000, "1" * 3000, "1" * 2000 + "." + "2" * 2000, " " * 4000, "\n" * 3000, "\t \r\n" * 500,
+                "/*" + "*" * 999 + "/", "/*" + " x " * 1000 + "*/", "// " + "y" * 3000 + "\n", "__" + "w" * 1000,
+                "#" + "a1" * 3, "@" * 100, "é" * 50 + "x" * 50]
+        sources = [generate_corpus(20)] + [rng.choice(runs) + " " + rng.choice(runs) + ";" + rng.choice(runs) for _ in range(200)]
+        mismatches = 0
+        for source in sources:
+            for trivia in ("keep", "skip"):
+                expected = [(t.type, t.start, t.end) for t in lexer.iter_tokens(source, trivia)]
+                if expected != [(t.type, t.start, t.end) for t in numpy_lexer.iter_tokens(source, trivia)]:
+                    mismatches += 1
+            expected = lexer.GenerateTokensWithErrors(source, "skip")
+            actual = numpy_lexer.GenerateTokensWithErrors(source, "skip")
+            if [[(t.type, t.start, t.end) for t in part] for part in expected] != [[(t.type, t.start, t.end) for t in part] for part in actual]:
+                mismatches += 1
+        print(f"numpy engine: {3 * len(sources) - mismatches}/{3 * len(sources)} lexes of long runs match the DFA")
@@ -0,0 +1,118 @@
+# This module keeps parsed programs on disk so that a source which was parsed before is not lexed or parsed again
+# Each entry is the tree of one program encoded by astnodes.encode_tree and stored with marshal, in a file named
+# by a hash of the source text, the AST version, the marshal version and the byte order, which the numbers of
+# an entry are packed in, so that a change to any of them misses
+
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+
+import astnodes as ast
+
+class ParseCache:
+
+    # The cache keeps its entries in directory, which is created if needed, and removes the least recently used ones
+    # once their total size goes over max_bytes
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Estimate of the total size of the entries, counted when the first entry is stored and then raised by the
+        # size of each entry stored, so that the directory is only scanned again once it may be over max_bytes
+        # Entries replaced or stored by other processes make it off, which the scan by evict corrects
+        self.total = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    # This method returns the path of the entry for a source
+    def path(self, src):
+        key = hashlib.blake2b(f"{ast.ast_version}:{marshal.version}:{sys.byteorder}:{src}".encode("utf-8"), digest_size=16)
+        return os.path.join(self.directory, key.hexdigest() + ".ast")
+
+    # This method returns the program cached for a source, or None if there is no usable entry
+    def load(self, src):
+        path = self.path(src)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            # A missing or unreadable entry is a miss, and the next store replaces it
+            self.misses += 1
+            return None
+        try:
+            program = ast.decode_tree(*marshal.loads(data))
+        except Exception:
+            # Any failure to decode an entry, e.g. one truncated or written by another version, is a miss,
+            # and the entry is removed so that it is not read again before the next store replaces it
+            self.misses += 1
+            self.remove(path)
+            return None
+        # The modification time of an entry is the time it was last used, which eviction goes by
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return program
+
+    # This method stores the program parsed from a source, then evicts entries if the cache may be over max_bytes
+    def store(self, src, program):
+        data = marshal.dumps(ast.encode_tree(program))
+        # Written to a temporary file first and moved into place so that a reader never sees a partial entry,
+        # also when several processes store the same source at once
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp, self.path(src))
+        except BaseException:
+            os.unlink(temp)
+            raise
+        if self.total is None:
+            self.total = self.size()[1]
+        else:
+            self.total += len(data)
+        if self.total > self.max_bytes:
+            self.evict()
+
+    # This method removes the least recently used entries until the total size is at most max_bytes
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(".ast"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+        self.total = total
+
+    # This method removes an entry, which another process may have removed already
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # This method returns the number of entries and their total size in bytes
+    def size(self):
+        count = total = 0
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(".ast"):
+                    try:
+                        total += entry.stat().st_size
+                    except FileNotFoundError:
+                        continue
+                    count += 1
+        return count, total
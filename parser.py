@@ -1,38 +1,147 @@
+import concurrent.futures
+import contextlib
+from functools import partial
+from multiprocessing import resource_tracker
+import os
+
 # Importing modules from the same directory
 import astnodes as ast # Gets the AST nodes
 import lexer as lex # Performs lexical analysis
+from parse_cache import ParseCache # Keeps parsed programs on disk
+
+# Token kinds the parser tests membership in, built once rather than as a list on every test
+type_tokens = frozenset({
+    lex.TokenType.kw_int,
+    lex.TokenType.kw_float,
+    lex.TokenType.kw_bool,
+    lex.TokenType.kw_colour
+})
+# Tokens after an identifier which make it an array element or a function call rather than a variable
+subscript_tokens = frozenset({lex.TokenType.lbracket, lex.TokenType.lparen})
+# Statements which end with a ';', the others end with a block
+semicolon_statements = frozenset({
+    lex.TokenType.kw_let,
+    lex.TokenType.identifier,
+    lex.TokenType.kw__print,
+    lex.TokenType.kw__delay,
+    lex.TokenType.kw__clear,
+    lex.TokenType.kw__write,
+    lex.TokenType.kw__write_box,
+    lex.TokenType.kw_return
+})
+# Keywords starting a statement, at which the parser resynchronises after a syntax error
+recovery_keywords = frozenset({lex.TokenType.kw_fun, lex.TokenType.kw_let})
+# Nodes of the literals by the kind of their token
+literal_nodes = {
+    lex.TokenType.integer: ast.ASTIntegerNode,
+    lex.TokenType.floatliteral: ast.ASTFloatNode,
+    lex.TokenType.booleanliteral: ast.ASTBooleanNode,
+    lex.TokenType.colourliteral: ast.ASTColourNode
+}
+
+# A syntax or lexical error reported by a Parser created with recover=True, at the token where it was found
+class SyntaxDiagnostic:
+
+    def __init__(self, message, token):
+        self.message = message
+        self.token = token
+
+    @property
+    def start(self):
+        return self.token.start
+
+    @property
+    def line(self):
+        return self.token.line
+
+    @property
+    def column(self):
+        return self.token.column
+
+    def __str__(self):
+        return f"{self.line}:{self.column}: {self.message}"
 
 # Parser class parsing the source program and generate ASTs
 class Parser:
     
+    # Number of tokens of lookahead the parser keeps after the current token
+    lookahead = 2
+
     # Constructor initializing the parser
-    def __init__(self, src_program_str):
+    # An already lexed token list or TokenBuffer can be passed as tokens, e.g. one attached from shared memory,
+    # in which case the source is not lexed again and the parser reads the tokens in order
+    # cache is an optional ParseCache, or the directory of one, from which Parse takes the program when the same
+    # source was parsed before, without lexing or parsing it
+    # With recover, Parse does not stop at the first error but adds a SyntaxDiagnostic to errors for each one,
+    # skips the statement it is in and carries on, so ASTroot is the program with an ASTErrorNode for each statement
+    # which was skipped
+    # With lazy_bodies, the body of each function is skipped by matching its braces and ParseFunctionDecl returns an
+    # ASTLazyFunctionDeclNode, whose body is parsed the first time it is used, so a syntax error in a body is
+    # raised then instead of by Parse, and names first seen in a body are interned then
+    # When the parser lexes the source itself the skipped bodies are not even lexed
+    # With pause_gc, Parse pauses the cyclic garbage collector by astnodes.paused_gc, which makes parsing large or
+    # deeply nested programs faster but affects the whole interpreter while it runs, see paused_gc
+    def __init__(self, src_program_str, tokens=None, cache=None, recover=False, lazy_bodies=False, pause_gc=False):
+        if recover and lazy_bodies:
+            raise ValueError("Cannot recover from errors in function bodies which are not parsed")
         self.lexer = lex.Lexer()
+        self.lazy_bodies = lazy_bodies
+        self.pause_gc = pause_gc
+        self.skip_text = tokens is None # Whether a skipped body can be found in the text rather than the tokens
+        self.cache = ParseCache(cache) if isinstance(cache, (str, os.PathLike)) else cache
+        self.errors = [] if recover else None
+        self.lexical_errors = [] if recover else None # Error tokens the lexer skipped over
         self.index = -1  # Starts at -1 so that the first token is at index 0
         self.src_program = src_program_str
-        self.tokens = self.lexer.GenerateTokensNoPrinting(self.src_program)
+        self.source = lex.SourceText(src_program_str) # Line index for the line_col of the nodes, built on first use
+        self.anchor = ast.Anchor() # Anchor of the nodes being made, one for each top-level statement of a program
+        # Tokens are pulled from the lexer as the parser advances, so each one is released once it has been consumed
+        # The lexer never creates whitespace, newline or comment tokens, so the parser sees only significant tokens
+        if tokens is None:
+            tokens = self.lexer.iter_tokens(self.src_program, "skip", self.lexical_errors)
+        self.tokens = iter(tokens)
+        self.endToken = lex.Token(lex.TokenType.end, "END")
+        # Ring buffer holding the lookahead tokens after the current one, the token at index i is in slot i % lookahead
+        self.ring = [next(self.tokens, self.endToken) for _ in range(self.lookahead)]
         self.crtToken = lex.Token("", lex.TokenType.error)
-        self.nextToken = lex.Token("", lex.TokenType.error)
-        
+        self.prevToken = self.crtToken # The token consumed last, whose end is where the node being made ends
+        self.nextToken = self.ring[0]
 
-    # Function to skip whitespace and comments
-    def NextTokenSkipWS_Comments(self):
+    # Function to move to the next token, which takes it out of the ring buffer and refills its slot from the lexer
+    def NextToken(self):
         self.index += 1   # Gets next token 
-        if (self.index < len(self.tokens)):
-            # Assigns the next token to the current token
-            self.crtToken = self.tokens[self.index]
-        else:
-            self.crtToken = lex.Token(lex.TokenType.end, "END")
+        self.prevToken = self.crtToken
+        slot = self.index % self.lookahead
+        self.crtToken = self.ring[slot]
+        self.ring[slot] = next(self.tokens, self.endToken)
+        self.nextToken = self.ring[(self.index + 1) % self.lookahead]
+
+    # Function returning the token offset tokens after the current one without consuming it, up to lookahead
+    def PeekToken(self, offset=1):
+        if not 0 < offset <= self.lookahead:
+            raise ValueError(f"Can only peek 1 to {self.lookahead} tokens ahead")
+        return self.ring[(self.index + offset) % self.lookahead]
+
+    # Function to carry on with the tokens of another stream, whose first token becomes the current one
+    def ResumeTokens(self, tokens):
+        self.tokens = tokens
+        for offset in range(1, self.lookahead + 1):
+            self.ring[(self.index + offset) % self.lookahead] = next(self.tokens, self.endToken)
+        self.NextToken()
 
-    # Function which skips whitespace and comments by calling the NextTokenSkipWS_Comments function
-    # once when it is not a whitespace or comment and keeps calling the NextTokenSkipWS_Comments if it is a whitespace or comment
-    def NextToken(self):
-        self.NextTokenSkipWS_Comments()
-        while (self.crtToken.type == lex.TokenType.whitespace 
-            or self.crtToken.type == lex.TokenType.linecomment
-            or self.crtToken.type == lex.TokenType.blockcomment
-            or self.crtToken.type == lex.TokenType.newline):
-            self.NextTokenSkipWS_Comments()
+    # Function which sets the span of node to the offsets from start to end, from the anchor of the statement
+    # being parsed, and returns it
+    def Spanned(self, node, start, end):
+        node.anchor = self.anchor
+        node.offset = start - self.anchor.shift
+        node.length = end - start
+        return node
+
+    # Function which interns the current identifier token in the lexer's symbol ids
+    # Returns its id and the name string shared by all occurrences of the identifier
+    def InternIdentifier(self):
+        symbol = self.lexer.symbols.intern(self.crtToken.lexeme)
+        return symbol, self.lexer.symbols.names[symbol]
 
         # Helper functions to check for specific tokens instead of repeating code
     def ExpectSemicolon(self):
@@ -49,16 +158,14 @@ class Parser:
     # The parsing functions are organized by the PARl EBNF grammar
     # The parsing functions check token by token using self.NextToken() to move to the next token
     # Every time a token is checked to see if it is the expected token in the grammar by checking its type
-    # The functions call each other recursively and use each other as arguments to parse the entire program
+    # The rules which can nest, i.e. everything that contains an expression or a block, are generators
+    # Instead of calling each other recursively they yield the generator of the rule they need to ast.run,
+    # which runs it on an explicit stack and sends its result back, so nesting depth is only limited by memory
+    # ⟨Type⟩, ⟨Literal⟩, ⟨PadWidth⟩, ⟨PadHeight⟩, ⟨VariableDeclArray⟩ and ⟨FormalParams⟩ cannot nest and are plain functions
 
     # ⟨Type⟩
     def ParseType(self):
-        if self.crtToken.type in [
-            lex.TokenType.kw_int,
-            lex.TokenType.kw_float,
-            lex.TokenType.kw_bool,
-            lex.TokenType.kw_colour
-        ]:
+        if self.crtToken.type in type_tokens:
             type_name = self.crtToken.lexeme
             self.NextToken()
             return type_name
@@ -66,61 +173,45 @@ class Parser:
             raise Exception("Syntax Error: Expected a type.")
 
     # ⟨Literal⟩
+    # ⟨IntegerLiteral⟩, ⟨FloatLiteral⟩, ⟨BooleanLiteral⟩ or ⟨ColourLiteral⟩, with the node looked up by the token kind
     def ParseLiteral(self):
-        # ⟨IntegerLiteral⟩
-        if self.crtToken.type == lex.TokenType.integer:
-            val = self.crtToken.lexeme
-            self.NextToken()
-            return ast.ASTIntegerNode(val)
-        
-        # ⟨FloatLiteral⟩
-        elif self.crtToken.type == lex.TokenType.floatliteral:
-            val = self.crtToken.lexeme
-            self.NextToken()
-            return ast.ASTFloatNode(val)
-
-        # ⟨BooleanLiteral⟩
-        elif self.crtToken.type == lex.TokenType.booleanliteral:
-            val = self.crtToken.lexeme
-            self.NextToken()
-            return ast.ASTBooleanNode(val)
-
-        # ⟨ColourLiteral⟩
-        elif self.crtToken.type == lex.TokenType.colourliteral:
-            val = self.crtToken.lexeme
-            self.NextToken()
-            return ast.ASTColourNode(val)
-
-        else:
+        node_class = literal_nodes.get(self.crtToken.type)
+        if node_class is None:
             raise Exception("Syntax Error: Expected a literal.")
+        token = self.crtToken
+        self.NextToken()
+        return self.Spanned(node_class(token.lexeme), token.start, token.end)
 
     # ⟨PadRead⟩
     def ParsePadRead(self):
         if self.crtToken.type != lex.TokenType.kw__read:
             raise Exception("Syntax Error: Expected '__read'")
+        start = self.crtToken.start
         self.NextToken()
 
-        expr1 = self.ParseExpression()
+        expr1 = yield self.ParseExpression()
 
         if self.crtToken.type != lex.TokenType.comma:
             raise Exception("Syntax Error: Expected ',' in __read")
         self.NextToken()
 
-        expr2 = self.ParseExpression()
+        expr2 = yield self.ParseExpression()
 
-        return ast.ASTPadReadNode(expr1, expr2)
+        return self.Spanned(ast.ASTPadReadNode(expr1, expr2), start, self.prevToken.end)
     
     # ⟨PadRandI⟩
     def ParsePadRandI(self):
         if self.crtToken.type != lex.TokenType.kw__random_int:
             raise Exception("Syntax Error: Expected '__random_int'")
+        start = self.crtToken.start
         self.NextToken()
 
-        expr = self.ParseExpression()
-        return ast.ASTPadRandINode(expr)
+        expr = yield self.ParseExpression()
+        return self.Spanned(ast.ASTPadRandINode(expr), start, self.prevToken.end)
         
     # ⟨FunctionCall⟩
-    def ParseFunctionCall(self, function_name):
+    # start is the offset of the function name
+    def ParseFunctionCall(self, function_name, symbol, start):
         # Assumes current token is '('
         # ⟨ActualParams⟩
         if self.crtToken.type != lex.TokenType.lparen:
@@ -130,163 +221,174 @@ class Parser:
         args = []
         if self.crtToken.type != lex.TokenType.rparen:
             # Parse first arg
-            args.append(self.ParseExpression())
+            arg = yield self.ParseExpression()
+            args.append(arg)
             # Parse remaining args
             while self.crtToken.type == lex.TokenType.comma:
                 self.NextToken()
-                args.append(self.ParseExpression())
+                arg = yield self.ParseExpression()
+                args.append(arg)
 
         if self.crtToken.type != lex.TokenType.rparen:
             raise Exception("Syntax Error: Expected ')' after function arguments.")
+        end = self.crtToken.end
         self.NextToken()
 
-        return ast.ASTFunctionCallNode(function_name, args)
-
-    # ⟨Factor⟩
-    def ParseFactor(self):
-        tok = self.crtToken
-
-        if tok.type in [
-            lex.TokenType.integer,
-            lex.TokenType.floatliteral,
-            lex.TokenType.booleanliteral,
-            lex.TokenType.colourliteral
-        ]:
-            return self.ParseLiteral()
-
-        elif tok.type == lex.TokenType.identifier:
-            # Could be a variable or function call
-            id_name = tok.lexeme
-            index_expr = None
-            self.NextToken()
-
-            # ⟨SubExpr⟩
-            if self.crtToken.type == lex.TokenType.lbracket:
-                self.NextToken()
-                index_expr = self.ParseExpression()
-                if self.crtToken.type != lex.TokenType.rbracket:
-                    raise Exception("Syntax Error: Expected ']' after array index")
-                self.NextToken()
-            if self.crtToken.type == lex.TokenType.lparen:
-                return self.ParseFunctionCall(id_name)
-            else:
-                return ast.ASTVariableNode(id_name, index_expr)
-
-        elif tok.type == lex.TokenType.lparen:
-            self.NextToken()
-            expr = self.ParseExpression()
-            if self.crtToken.type != lex.TokenType.rparen:
-                raise Exception("Syntax Error: expected ')'")
-            self.NextToken()
-            return expr
-
-        # ⟨UnaryOp⟩
-        elif tok.type in [lex.TokenType.minus, lex.TokenType.kw_not]:
-            op = tok.lexeme
+        return self.Spanned(ast.ASTFunctionCallNode(function_name, args, symbol), start, end)
+
+    # ⟨Factor⟩ which cannot nest, a literal, __width, __height or a variable without an index,
+    # parsed directly instead of through ast.run, with the lookahead token telling a variable apart from an array element or call
+    # Returns None for any other factor
+    def ParseLeafFactor(self):
+        parse = self.leaf_factor_parsers.get(self.crtToken.type)
+        if parse is not None:
+            return parse(self)
+        if self.crtToken.type == lex.TokenType.identifier and self.nextToken.type not in subscript_tokens:
+            token = self.crtToken
+            symbol, id_name = self.InternIdentifier()
             self.NextToken()
-            expr = self.ParseExpression()
-            return ast.ASTUnaryOpNode(op, expr)
+            return self.Spanned(ast.ASTVariableNode(id_name, None, symbol), token.start, token.end)
+        return None
 
-        elif tok.type == lex.TokenType.kw__read:
-            return self.ParsePadRead()
-
-        elif tok.type == lex.TokenType.kw__random_int:
-            return self.ParsePadRandI()
+    # ⟨Factor⟩, dispatched on the kind of its first token
+    def ParseFactor(self):
+        leaf = self.ParseLeafFactor()
+        if leaf is not None:
+            return leaf
+        parse = self.factor_parsers.get(self.crtToken.type)
+        if parse is None:
+            raise Exception(f"Syntax Error: Unexpected token {self.crtToken.type} in factor")
+        return (yield parse(self))
+
+    # ⟨Factor⟩ starting with an identifier, a variable, an array element or a function call
+    def ParseIdentifierFactor(self):
+        symbol, id_name = self.InternIdentifier()
+        index_expr = None
+        start = self.crtToken.start
+        end = self.crtToken.end
+        self.NextToken()
 
-        # ⟨PadWidth⟩
-        elif tok.type == lex.TokenType.kw__width:
+        # ⟨SubExpr⟩
+        if self.crtToken.type == lex.TokenType.lbracket:
             self.NextToken()
-            return ast.ASTPadWidthNode()
-        
-        # ⟨PadHeight⟩
-        elif tok.type == lex.TokenType.kw__height:
+            index_expr = yield self.ParseExpression()
+            if self.crtToken.type != lex.TokenType.rbracket:
+                raise Exception("Syntax Error: Expected ']' after array index")
+            end = self.crtToken.end
             self.NextToken()
-            return ast.ASTPadHeightNode()
-
+        if self.crtToken.type == lex.TokenType.lparen:
+            return (yield self.ParseFunctionCall(id_name, symbol, start))
         else:
-            raise Exception(f"Syntax Error: Unexpected token {tok.type} in factor")
-
-    # ⟨Term⟩
-    def ParseTerm(self):
-        left = self.ParseFactor()
-
-        # ⟨MultiplicativeOp⟩
-        while self.crtToken.type in [
-            lex.TokenType.multiply,
-            lex.TokenType.slash,
-            lex.TokenType.kw_and
-        ]:
-            op = self.crtToken.lexeme
-            self.NextToken()
-            right = self.ParseFactor()
-            left = ast.ASTBinaryOpNode(op, left, right)
+            return self.Spanned(ast.ASTVariableNode(id_name, index_expr, symbol), start, end)
 
-        return left
+    # ⟨Factor⟩ which is a parenthesised ⟨Expr⟩, which keeps the span of the ⟨Expr⟩ inside the parentheses
+    # The node around it spans the parentheses, as it starts at its first token and ends at its last
+    def ParseParenthesised(self):
+        self.NextToken()
+        expr = yield self.ParseExpression()
+        if self.crtToken.type != lex.TokenType.rparen:
+            raise Exception("Syntax Error: expected ')'")
+        self.NextToken()
+        return expr
 
-    # ⟨SimpleExpr⟩
-    def ParseSimpleExpression(self):
-        left = self.ParseTerm()
+    # ⟨UnaryOp⟩
+    def ParseUnaryOp(self):
+        token = self.crtToken
+        self.NextToken()
+        expr = yield self.ParseExpression()
+        return self.Spanned(ast.ASTUnaryOpNode(token.lexeme, expr), token.start, self.prevToken.end)
 
-        # ⟨AdditiveOp⟩
-        while self.crtToken.type in [
-            lex.TokenType.plus,
-            lex.TokenType.minus,
-            lex.TokenType.kw_or
-        ]:
-            op = self.crtToken.lexeme
-            self.NextToken()
-            right = self.ParseTerm()
-            left = ast.ASTBinaryOpNode(op, left, right)
+    # ⟨PadWidth⟩
+    def ParsePadWidth(self):
+        token = self.crtToken
+        self.NextToken()
+        return self.Spanned(ast.ASTPadWidthNode(), token.start, token.end)
 
-        return left
-    
-    # ⟨Expr⟩
-    def ParseExpression(self):
-        left = self.ParseSimpleExpression()
-
-        # ⟨RelationalOp⟩
-        if self.crtToken.type in [
-            lex.TokenType.less,
-            lex.TokenType.greater,
-            lex.TokenType.equal_equal,
-            lex.TokenType.not_equal,
-            lex.TokenType.less_equal,
-            lex.TokenType.greater_equal
-        ]:
+    # ⟨PadHeight⟩
+    def ParsePadHeight(self):
+        token = self.crtToken
+        self.NextToken()
+        return self.Spanned(ast.ASTPadHeightNode(), token.start, token.end)
+
+    # Binding powers of the binary operators, a higher power binds tighter
+    # ⟨MultiplicativeOp⟩ binds a ⟨Term⟩, ⟨AdditiveOp⟩ a ⟨SimpleExpr⟩ and ⟨RelationalOp⟩ an ⟨Expr⟩
+    relational_power = 1
+    tightest_power = 3
+    binding_powers = {
+        lex.TokenType.multiply: 3,
+        lex.TokenType.slash: 3,
+        lex.TokenType.kw_and: 3,
+        lex.TokenType.plus: 2,
+        lex.TokenType.minus: 2,
+        lex.TokenType.kw_or: 2,
+        lex.TokenType.less: relational_power,
+        lex.TokenType.greater: relational_power,
+        lex.TokenType.equal_equal: relational_power,
+        lex.TokenType.not_equal: relational_power,
+        lex.TokenType.less_equal: relational_power,
+        lex.TokenType.greater_equal: relational_power,
+    }
+
+    # ⟨Expr⟩, ⟨SimpleExpr⟩ and ⟨Term⟩ parsed by precedence climbing over binding_powers
+    # Operators binding at least min_power are folded into left-associative binary nodes,
+    # with their right operand parsed at one power higher, which is just a ⟨Factor⟩ for the tightest operators
+    # A relational operator does not associate, so after one only tighter operators may follow,
+    # and a cast with 'as' applies to the whole ⟨Expr⟩
+    def ParseExpression(self, min_power=relational_power):
+        is_expr = min_power == self.relational_power
+        binding_powers = self.binding_powers
+        start = self.crtToken.start
+        left = self.ParseLeafFactor()
+        if left is None:
+            left = yield self.ParseFactor()
+
+        power = binding_powers.get(self.crtToken.type, 0)
+        while power >= min_power:
             op = self.crtToken.lexeme
             self.NextToken()
-            right = self.ParseSimpleExpression()
-            left = ast.ASTBinaryOpNode(op, left, right)
+            if power == self.tightest_power:
+                right = self.ParseLeafFactor()
+                if right is None:
+                    right = yield self.ParseFactor()
+            else:
+                right = yield self.ParseExpression(power + 1)
+            left = self.Spanned(ast.ASTBinaryOpNode(op, left, right), start, self.prevToken.end)
+            if power == self.relational_power:
+                min_power = power + 1
+            power = binding_powers.get(self.crtToken.type, 0)
 
-        if self.crtToken.type == lex.TokenType.kw_as:
+        if is_expr and self.crtToken.type == lex.TokenType.kw_as:
             self.NextToken()
+            end = self.crtToken.end
             cast_type = self.ParseType()
-            left = ast.ASTCastNode(left, cast_type)
+            left = self.Spanned(ast.ASTCastNode(left, cast_type), start, end)
 
         return left
     
     # ⟨Assignment⟩
     def ParseAssignment(self):
+        start = self.crtToken.start
         if (self.crtToken.type == lex.TokenType.identifier):
-            assignment_lhs = self.ParseExpression()
+            assignment_lhs = yield self.ParseExpression()
             if not isinstance(assignment_lhs, ast.ASTVariableNode):
                 raise Exception("Syntax Error: Left-hand side must be a variable")
 
         if (self.crtToken.type == lex.TokenType.equals):
             self.NextToken()
-        assignment_rhs = self.ParseExpression()
+        assignment_rhs = yield self.ParseExpression()
 
-        return ast.ASTAssignmentNode(assignment_lhs, assignment_rhs)
+        return self.Spanned(ast.ASTAssignmentNode(assignment_lhs, assignment_rhs), start, self.prevToken.end)
 
     # ⟨VariableDecl⟩
     def ParseVariableDecl(self):
         if self.crtToken.type != lex.TokenType.kw_let:
             raise Exception("Syntax Error: Expected 'let' at start of variable declaration.")
+        start = self.crtToken.start
         self.NextToken()
 
         if self.crtToken.type != lex.TokenType.identifier:
             raise Exception("Syntax Error: Expected identifier after 'let'.")
-        identifier = self.crtToken.lexeme
+        symbol, identifier = self.InternIdentifier()
         self.NextToken()
 
         if self.crtToken.type != lex.TokenType.colon:
@@ -297,23 +399,23 @@ class Parser:
 
         if self.crtToken.type == lex.TokenType.equals:
             self.NextToken()
-            expr = self.ParseExpression()
-            return ast.ASTVariableDeclNode(identifier, vartype, expr)
+            expr = yield self.ParseExpression()
+            return self.Spanned(ast.ASTVariableDeclNode(identifier, vartype, expr, symbol), start, self.prevToken.end)
 
         # ⟨VariableDeclSuffix⟩
         elif self.crtToken.type == lex.TokenType.lbracket:
-            return self.ParseVariableDeclArray(identifier, vartype)
+            return self.ParseVariableDeclArray(identifier, vartype, symbol, start)
 
         else:
             raise Exception("Syntax Error: Expected '=' or '[' in variable declaration")
         
-    # ⟨VariableDeclArray⟩    
-    def ParseVariableDeclArray(self, identifier, vartype):
+    # ⟨VariableDeclArray⟩, start is the offset of 'let'
+    def ParseVariableDeclArray(self, identifier, vartype, symbol, start):
         self.NextToken()
 
         # Case 1: declared size array
         if self.crtToken.type == lex.TokenType.integer:
-            size = ast.ASTIntegerNode(self.crtToken.lexeme)
+            size = self.Spanned(ast.ASTIntegerNode(self.crtToken.lexeme), self.crtToken.start, self.crtToken.end)
             self.NextToken()
 
             if self.crtToken.type != lex.TokenType.rbracket:
@@ -332,9 +434,10 @@ class Parser:
 
             if self.crtToken.type != lex.TokenType.rbracket:
                 raise Exception("Expected ']' after single array literal")
+            end = self.crtToken.end
             self.NextToken()
 
-            return ast.ASTArrayDeclNode(identifier, vartype + "[]", size, [value])
+            return self.Spanned(ast.ASTArrayDeclNode(identifier, vartype + "[]", size, [value], symbol), start, end)
 
         # Case 2: inferred size [] = [val, val, ...]
         elif self.crtToken.type == lex.TokenType.rbracket:
@@ -357,9 +460,10 @@ class Parser:
 
             if self.crtToken.type != lex.TokenType.rbracket:
                 raise Exception("Expected ']' to close array literal")
+            end = self.crtToken.end
             self.NextToken()
 
-            return ast.ASTArrayDeclNode(identifier, vartype + "[]", size, values)
+            return self.Spanned(ast.ASTArrayDeclNode(identifier, vartype + "[]", size, values, symbol), start, end)
 
         else:
             raise Exception("Syntax Error: Invalid array declaration format")
@@ -368,52 +472,56 @@ class Parser:
     def ParsePrintStatement(self):
         if self.crtToken.type != lex.TokenType.kw__print:
             raise Exception("Syntax Error: Expected '__print'")
+        start = self.crtToken.start
         self.NextToken()
 
-        expr = self.ParseExpression()
-        return ast.ASTPrintNode(expr)
+        expr = yield self.ParseExpression()
+        return self.Spanned(ast.ASTPrintNode(expr), start, self.prevToken.end)
     
     # ⟨DelayStatement⟩
     def ParseDelayStatement(self):
         if self.crtToken.type != lex.TokenType.kw__delay:
             raise Exception("Syntax Error: Expected '__delay'")
+        start = self.crtToken.start
         self.NextToken()
 
-        expr = self.ParseExpression()
-        return ast.ASTDelayNode(expr)
+        expr = yield self.ParseExpression()
+        return self.Spanned(ast.ASTDelayNode(expr), start, self.prevToken.end)
     
     # ⟨ClearStatement⟩ which is added to the language
     def ParseClearStatement(self):
         if self.crtToken.type != lex.TokenType.kw__clear:
             raise Exception("Syntax Error: Expected '__clear'")
+        start = self.crtToken.start
         self.NextToken()
 
-        expr = self.ParseExpression()
-        return ast.ASTClearNode(expr)
+        expr = yield self.ParseExpression()
+        return self.Spanned(ast.ASTClearNode(expr), start, self.prevToken.end)
     
     # ⟨WriteStatement⟩
     def ParseWriteStatement(self):
+        start = self.crtToken.start
         if self.crtToken.type == lex.TokenType.kw__write:
             self.NextToken()
-            x_expr = self.ParseExpression()
+            x_expr = yield self.ParseExpression()
             self.ExpectComma()
-            y_expr = self.ParseExpression()
+            y_expr = yield self.ParseExpression()
             self.ExpectComma()
-            val_expr = self.ParseExpression()
-            return ast.ASTWriteNode(x_expr, y_expr, val_expr)
+            val_expr = yield self.ParseExpression()
+            return self.Spanned(ast.ASTWriteNode(x_expr, y_expr, val_expr), start, self.prevToken.end)
 
         elif self.crtToken.type == lex.TokenType.kw__write_box:
             self.NextToken()
-            x_expr = self.ParseExpression()
+            x_expr = yield self.ParseExpression()
             self.ExpectComma()
-            y_expr = self.ParseExpression()
+            y_expr = yield self.ParseExpression()
             self.ExpectComma()
-            w_expr = self.ParseExpression()
+            w_expr = yield self.ParseExpression()
             self.ExpectComma()
-            h_expr = self.ParseExpression()
+            h_expr = yield self.ParseExpression()
             self.ExpectComma()
-            val_expr = self.ParseExpression()
-            return ast.ASTWriteBoxNode(x_expr, y_expr, w_expr, h_expr, val_expr)
+            val_expr = yield self.ParseExpression()
+            return self.Spanned(ast.ASTWriteBoxNode(x_expr, y_expr, w_expr, h_expr, val_expr), start, self.prevToken.end)
 
         else:
             raise Exception("Syntax Error: Expected '__write' or '__write_box'")
@@ -422,40 +530,43 @@ class Parser:
     def ParseRtrnStatement(self):
         if self.crtToken.type != lex.TokenType.kw_return:
             raise Exception("Syntax Error: Expected '_return'")
+        start = self.crtToken.start
         self.NextToken()
 
-        expr = self.ParseExpression()
-        return ast.ASTRtrnNode(expr)
+        expr = yield self.ParseExpression()
+        return self.Spanned(ast.ASTRtrnNode(expr), start, self.prevToken.end)
         
     # ⟨IfStatement⟩
     def ParseIfStatement(self):
         if self.crtToken.type != lex.TokenType.kw_if:
             raise Exception("Syntax Error: Expected 'if'")
+        start = self.crtToken.start
         self.NextToken()
 
         if self.crtToken.type != lex.TokenType.lparen:
             raise Exception("Syntax Error: Expected '(' after 'if'")
         self.NextToken()
 
-        condition = self.ParseExpression()
+        condition = yield self.ParseExpression()
 
         if self.crtToken.type != lex.TokenType.rparen:
             raise Exception("Syntax Error: Expected ')' after condition")
         self.NextToken()
 
-        then_block = self.ParseBlock()
+        then_block = yield self.ParseBlock()
 
         else_block = None
         if self.crtToken.type == lex.TokenType.kw_else:
             self.NextToken()
-            else_block = self.ParseBlock()
+            else_block = yield self.ParseBlock()
 
-        return ast.ASTIfNode(condition, then_block, else_block)
+        return self.Spanned(ast.ASTIfNode(condition, then_block, else_block), start, (else_block or then_block).end)
     
     # ⟨ForStatement⟩
     def ParseForStatement(self):
         if self.crtToken.type != lex.TokenType.kw_for:
             raise Exception("Syntax Error: Expected 'for'")
+        start = self.crtToken.start
         self.NextToken()
 
         if self.crtToken.type != lex.TokenType.lparen:
@@ -465,54 +576,55 @@ class Parser:
         # Optional initializer
         init = None
         if self.crtToken.type == lex.TokenType.kw_let:
-            init = self.ParseVariableDecl()
+            init = yield self.ParseVariableDecl()
 
         self.ExpectSemicolon()
 
         # Condition (required)
-        condition = self.ParseExpression()
+        condition = yield self.ParseExpression()
 
         self.ExpectSemicolon()
 
         # Optional update
         update = None
         if self.crtToken.type == lex.TokenType.identifier:
-            update = self.ParseAssignment()
+            update = yield self.ParseAssignment()
 
         if self.crtToken.type != lex.TokenType.rparen:
             raise Exception("Syntax Error: Expected ')' to close 'for' loop control")
         self.NextToken()
 
         # Block
-        body = self.ParseBlock()
+        body = yield self.ParseBlock()
 
-        return ast.ASTForNode(init, condition, update, body)
+        return self.Spanned(ast.ASTForNode(init, condition, update, body), start, body.end)
     
     # ⟨WhileStatement⟩  
     def ParseWhileStatement(self):
         if self.crtToken.type != lex.TokenType.kw_while:
             raise Exception("Syntax Error: Expected 'while'")
+        start = self.crtToken.start
         self.NextToken()
 
         if self.crtToken.type != lex.TokenType.lparen:
             raise Exception("Syntax Error: Expected '(' after 'while'")
         self.NextToken()
 
-        condition = self.ParseExpression()
+        condition = yield self.ParseExpression()
 
         if self.crtToken.type != lex.TokenType.rparen:
             raise Exception("Syntax Error: Expected ')' after condition")
         self.NextToken()
 
-        body = self.ParseBlock()
+        body = yield self.ParseBlock()
 
-        return ast.ASTWhileNode(condition, body)
+        return self.Spanned(ast.ASTWhileNode(condition, body), start, body.end)
     
     # ⟨FormalParam⟩
     def ParseFormalParam(self):
         if self.crtToken.type != lex.TokenType.identifier:
             raise Exception("Expected identifier in parameter list")
-        name = self.crtToken.lexeme
+        symbol, name = self.InternIdentifier()
         self.NextToken()
 
         if self.crtToken.type != lex.TokenType.colon:
@@ -527,7 +639,7 @@ class Parser:
             self.NextToken()
             if self.crtToken.type != lex.TokenType.integer:
                 raise Exception("Expected integer size for array parameter")
-            size = ast.ASTIntegerNode(self.crtToken.lexeme)
+            size = self.Spanned(ast.ASTIntegerNode(self.crtToken.lexeme), self.crtToken.start, self.crtToken.end)
             self.NextToken()
             if self.crtToken.type != lex.TokenType.rbracket:
                 raise Exception("Expected ']' after array size")
@@ -535,7 +647,7 @@ class Parser:
             param_type += "[]"
 
         
-        return (name, param_type, size)
+        return (name, param_type, size, symbol)
     
     # ⟨FormalParams⟩
     def ParseFormalParams(self):
@@ -549,11 +661,12 @@ class Parser:
     def ParseFunctionDecl(self):
         if self.crtToken.type != lex.TokenType.kw_fun:
             raise Exception("Syntax Error: Expected 'fun' at start of function declaration")
+        start = self.crtToken.start
         self.NextToken()
 
         if self.crtToken.type != lex.TokenType.identifier:
             raise Exception("Expected function name after 'fun'")
-        name = self.crtToken.lexeme
+        symbol, name = self.InternIdentifier()
         self.NextToken()
 
         if self.crtToken.type != lex.TokenType.lparen:
@@ -563,6 +676,9 @@ class Parser:
         params = []
         if self.crtToken.type != lex.TokenType.rparen:
             params = self.ParseFormalParams()
+        # Splits the symbol ids off the (name, type, size) parameter tuples
+        param_symbols = [param[3] for param in params]
+        params = [param[:3] for param in params]
 
         if self.crtToken.type != lex.TokenType.rparen:
             raise Exception("Expected ')' after parameters")
@@ -585,80 +701,478 @@ class Parser:
                 raise Exception("Expected ']' after return size")
             self.NextToken()
 
-        body = self.ParseBlock()
-        return ast.ASTFunctionDeclNode(name, params, return_type, return_size, body)
+        if self.lazy_bodies:
+            parse_body, end = self.SkipBlock()
+            function = ast.ASTLazyFunctionDeclNode(name, params, return_type, return_size, parse_body, symbol, param_symbols)
+            return self.Spanned(function, start, end)
+
+        body = yield self.ParseBlock()
+        function = ast.ASTFunctionDeclNode(name, params, return_type, return_size, body, symbol, param_symbols)
+        return self.Spanned(function, start, body.end)
+
+    # Skips the block at the current token without parsing it, for a function body with lazy_bodies
+    # Returns a function which parses the block, and the offset just past its closing '}'
+    def SkipBlock(self):
+        if self.crtToken.type != lex.TokenType.lbrace:
+            raise Exception("Syntax Error: Expected '{' to start a block")
+        first = self.crtToken
+
+        # The closing brace is found in the text, and lexing carries on after it
+        if self.skip_text:
+            end = self.lexer.MatchBrace(first.source.text, first.start)
+            if end is None:
+                raise Exception("Syntax Error: Unexpected end of input inside block")
+            self.ResumeTokens(self.lexer.IterTokensFrom(first.source, end))
+            return partial(parse_skipped_block, self.lexer, self.anchor, first.source, first.start), end
 
-    # ⟨Statement⟩ 
+        # Otherwise the tokens up to the closing brace are kept for when the block is parsed
+        tokens = [first]
+        depth = 1
+        while depth:
+            self.NextToken()
+            if self.crtToken.type == lex.TokenType.end:
+                raise Exception("Syntax Error: Unexpected end of input inside block")
+            if self.crtToken.type == lex.TokenType.lbrace:
+                depth += 1
+            elif self.crtToken.type == lex.TokenType.rbrace:
+                depth -= 1
+            tokens.append(self.crtToken)
+        self.NextToken()  # Consumes '}'
+        return partial(parse_skipped_block, self.lexer, self.anchor, self.src_program, first.start, tokens), tokens[-1].end
+
+    # ⟨Statement⟩, dispatched on the kind of its first token
     def ParseStatement(self):
-        if self.crtToken.type == lex.TokenType.kw_let:
-            stmt = self.ParseVariableDecl()
-            self.ExpectSemicolon()
-            return stmt
-        elif self.crtToken.type == lex.TokenType.identifier:
-            stmt = self.ParseAssignment()
-            self.ExpectSemicolon()
-            return stmt
-        elif self.crtToken.type == lex.TokenType.kw__print:
-            stmt = self.ParsePrintStatement()
-            self.ExpectSemicolon()
-            return stmt
-        elif self.crtToken.type == lex.TokenType.kw__delay:
-            stmt = self.ParseDelayStatement()
-            self.ExpectSemicolon()
-            return stmt
-        elif self.crtToken.type == lex.TokenType.kw__clear:
-            stmt = self.ParseClearStatement()
-            self.ExpectSemicolon()
-            return stmt
-        elif self.crtToken.type in [lex.TokenType.kw__write, lex.TokenType.kw__write_box]:
-            stmt = self.ParseWriteStatement()
-            self.ExpectSemicolon()
-            return stmt
-        elif (self.crtToken.type == lex.TokenType.kw_if):
-            return self.ParseIfStatement()
-        elif (self.crtToken.type == lex.TokenType.kw_for):
-            return self.ParseForStatement()
-        elif (self.crtToken.type == lex.TokenType.kw_while):
-            return self.ParseWhileStatement()
-        elif (self.crtToken.type == lex.TokenType.kw_return):
-            stmt = self.ParseRtrnStatement()
-            self.ExpectSemicolon()
-            return stmt
-        elif (self.crtToken.type == lex.TokenType.kw_fun):
-            return self.ParseFunctionDecl()
-        elif self.crtToken.type == lex.TokenType.lbrace:
-            return self.ParseBlock()
-        else:
+        kind = self.crtToken.type
+        parse = self.statement_parsers.get(kind)
+        if parse is None:
             raise Exception(f"Syntax Error: Unexpected token {self.crtToken.type}")
+        stmt = yield parse(self)
+        if kind in semicolon_statements:
+            # The span of the statement takes in its ';'
+            end = self.crtToken.end
+            self.ExpectSemicolon()
+            stmt.end = end
+        return stmt
 
     # ⟨Block⟩
     def ParseBlock(self):
         if self.crtToken.type != lex.TokenType.lbrace:
             raise Exception("Syntax Error: Expected '{' to start a block")
 
+        block = self.Spanned(ast.ASTBlockNode(), self.crtToken.start, self.crtToken.end)
         self.NextToken()  # consume '{'
-        block = ast.ASTBlockNode()
 
         while self.crtToken.type != lex.TokenType.rbrace:
             if self.crtToken.type == lex.TokenType.end:
-                raise Exception("Syntax Error: Unexpected end of input inside block")
-            stmt = self.ParseStatement()
+                if self.errors is None:
+                    raise Exception("Syntax Error: Unexpected end of input inside block")
+                # When recovering, the blocks left open are closed where the input ends and the error reported once
+                if not self.errors or self.errors[-1].token is not self.crtToken:
+                    message = "Syntax Error: Unexpected end of input inside block"
+                    self.errors.append(SyntaxDiagnostic(message, self.crtToken))
+                block.end = self.crtToken.start
+                return block
+            first = self.crtToken
+            try:
+                stmt = yield self.ParseStatement()
+            except Exception as error:
+                if self.errors is None:
+                    raise
+                stmt = self.Recover(error, first)
             if stmt:
                 block.add_statement(stmt)
 
+        block.end = self.crtToken.end
         self.NextToken()  # Consumes '}'
         return block
 
     # ⟨Program⟩ 
     def ParseProgram(self):
         self.NextToken()
-        program = ast.ASTProgramNode()
+        program = ast.ASTProgramNode(self.lexer.symbols, self.source, self.lazy_bodies)
+        self.Spanned(program, 0, len(self.src_program))
         while self.crtToken.type != lex.TokenType.end:
-            stmt = self.ParseStatement()
+            first = self.crtToken
+            # The nodes of each top-level statement are spanned from an anchor of its own
+            self.anchor = ast.Anchor()
+            try:
+                stmt = yield self.ParseStatement()
+            except Exception as error:
+                if self.errors is None:
+                    raise
+                stmt = self.Recover(error, first)
             if stmt:
+                self.anchor.owner = stmt
                 program.add_statement(stmt)
-        return program     
+        return program
+
+    # Records the error raised while parsing the statement starting at the token first and skips ahead to where
+    # parsing can carry on: past the next ';' or block, or up to the next '}', 'fun' or 'let' after first
+    # Returns the ASTErrorNode standing in for the statement
+    def Recover(self, error, first):
+        self.errors.append(SyntaxDiagnostic(str(error), self.crtToken))
+        end = self.crtToken.start
+        depth = 0 # Braces opened while skipping, whose block is skipped as a whole
+        while self.crtToken.type != lex.TokenType.end:
+            token = self.crtToken
+            kind = token.type
+            if depth == 0 and token is not first and (kind == lex.TokenType.rbrace or kind in recovery_keywords):
+                break
+            self.NextToken()
+            end = token.end
+            if kind == lex.TokenType.lbrace:
+                depth += 1
+            elif kind == lex.TokenType.rbrace:
+                depth -= 1
+            if depth <= 0 and (kind == lex.TokenType.semicolon or kind == lex.TokenType.rbrace):
+                break
+        # The error spans from the first token of the statement to the last token skipped
+        return self.Spanned(ast.ASTErrorNode(str(error)), first.start, end)
+
+    # Dispatch tables from the kind of the first token of a statement or factor to the rule parsing it,
+    # built once with the class and called with the parser as self
+    statement_parsers = {
+        lex.TokenType.kw_let: ParseVariableDecl,
+        lex.TokenType.identifier: ParseAssignment,
+        lex.TokenType.kw__print: ParsePrintStatement,
+        lex.TokenType.kw__delay: ParseDelayStatement,
+        lex.TokenType.kw__clear: ParseClearStatement,
+        lex.TokenType.kw__write: ParseWriteStatement,
+        lex.TokenType.kw__write_box: ParseWriteStatement,
+        lex.TokenType.kw_if: ParseIfStatement,
+        lex.TokenType.kw_for: ParseForStatement,
+        lex.TokenType.kw_while: ParseWhileStatement,
+        lex.TokenType.kw_return: ParseRtrnStatement,
+        lex.TokenType.kw_fun: ParseFunctionDecl,
+        lex.TokenType.lbrace: ParseBlock
+    }
+    # Factors which cannot nest are plain calls, the others are generators run through ast.run
+    leaf_factor_parsers = {
+        lex.TokenType.integer: ParseLiteral,
+        lex.TokenType.floatliteral: ParseLiteral,
+        lex.TokenType.booleanliteral: ParseLiteral,
+        lex.TokenType.colourliteral: ParseLiteral,
+        lex.TokenType.kw__width: ParsePadWidth,
+        lex.TokenType.kw__height: ParsePadHeight
+    }
+    factor_parsers = {
+        lex.TokenType.identifier: ParseIdentifierFactor,
+        lex.TokenType.lparen: ParseParenthesised,
+        lex.TokenType.minus: ParseUnaryOp,
+        lex.TokenType.kw_not: ParseUnaryOp,
+        lex.TokenType.kw__read: ParsePadRead,
+        lex.TokenType.kw__random_int: ParsePadRandI
+    }
+
+    # Fewest characters per worker for which Parse parses in parallel, as starting the pool would cost more below it
+    parallel_min_chars = 1 << 16
+
+    # Fewest cores for which Parse(None) parses in parallel
+    # Lexing into a shared buffer, starting the workers and sending the runs back encoded takes the parallel parse
+    # 1.7 to 2 times the CPU time of a serial one (bench_parse_parallel on one core), so on two cores it is slower
+    # whatever the split, and it can only gain from about four
+    parallel_min_cores = 4
 
     # Entry point for parsing the entire program into an AST
-    def Parse(self):        
-        self.ASTroot = self.ParseProgram()
\ No newline at end of file
+    # With more than one worker the top-level statements are parsed in parallel by ParseParallel, which builds
+    # the same AST, except when recovering from errors
+    # None is one worker per core when there are at least parallel_min_cores of them, and a serial parse otherwise
+    def Parse(self, workers=1):
+        with ast.paused_gc() if self.pause_gc else contextlib.nullcontext():
+            if self.cache is not None:
+                program = self.cache.load(self.src_program)
+                if program is not None:
+                    program.source = self.source
+                    program.lazy_bodies = False
+                    self.ASTroot = program
+                    self.lexer.symbols = program.symbols
+                    return
+            if workers is None:
+                cores = os.cpu_count() or 1
+                workers = cores if cores >= self.parallel_min_cores else 1
+            if workers != 1 and self.errors is None and not self.lazy_bodies:
+                self.ASTroot = self.ParseParallel(workers)
+            else:
+                self.ASTroot = ast.run(self.ParseProgram())
+            if self.errors is not None:
+                for token in self.lexical_errors:
+                    self.errors.append(SyntaxDiagnostic(f"Lexical Error: Unexpected {token.lexeme!r}", token))
+                self.errors.sort(key=lambda diagnostic: diagnostic.start)
+                # A program with errors is not cached, its parse is only partial
+                if self.errors:
+                    return
+            # Nor is a program with bodies left to parse, which encoding it would parse
+            if self.cache is not None and not self.lazy_bodies:
+                self.cache.store(self.src_program, self.ASTroot)
+
+    # Parses the program with the top-level statements split into one run of statements per worker
+    # The source is lexed in parallel into a TokenBuffer, in which statement_ends finds where the statements end,
+    # and the buffer is then shared with the workers, in which parse_chunk parses each run as a program of its own
+    # The runs are joined in order and their symbol ids renumbered as if they had been interned in one pass
+    # If a run cannot be parsed the program is parsed serially instead, which raises the same error as Parse
+    # Any other failure, of the pool, the shared buffer or a worker, is raised as it is
+    def ParseParallel(self, workers):
+        workers = min(workers, len(self.src_program) // self.parallel_min_chars)
+        if workers <= 1:
+            return ast.run(self.ParseProgram())
+
+        # The workers attach the shared buffer, which registers it with the resource tracker of their parent,
+        # so the tracker is started before them, otherwise each would start its own which unlinks the buffer
+        resource_tracker.ensure_running()
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            buffer = lex.Lexer("compiled").token_buffer_parallel(self.src_program, pool, workers)
+            # The statements are split near every multiple of the token count over workers
+            ends = statement_ends(buffer)
+            points = [0]
+            for k in range(1, workers):
+                target = len(buffer) * k // workers
+                point = next((end for end in ends if end >= target), None)
+                if point is not None and point > points[-1]:
+                    points.append(point)
+            points.append(len(buffer))
+
+            shared = buffer.share()
+            try:
+                names = [shared.shared.name] * (len(points) - 1)
+                chunks = list(pool.map(parse_chunk, names, points, points[1:]))
+            finally:
+                shared.close()
+                shared.unlink()
+        if None in chunks:
+            return ast.run(self.ParseProgram())
+
+        program = self.Spanned(ast.ASTProgramNode(self.lexer.symbols, self.source), 0, len(self.src_program))
+        for names, tree in chunks:
+            # The ids of a run are renumbered by interning its names after those of the runs before it
+            renumber_symbols(tree, [self.lexer.symbols.intern(name) for name in names])
+            program.stmts.extend(ast.decode_tree(*tree).stmts)
+        return program
+
+# Indices just past the last token of each top-level statement in a TokenBuffer, found by matching brackets
+# A statement ends with a ';' outside any brace or parenthesis, or with the '}' closing its last block unless
+# an else follows it, which is where the parser ends it in a program without syntax errors
+def statement_ends(buffer):
+    lbrace, rbrace = lex.TokenType.lbrace.value, lex.TokenType.rbrace.value
+    lparen, rparen = lex.TokenType.lparen.value, lex.TokenType.rparen.value
+    semicolon, kw_else = lex.TokenType.semicolon.value, lex.TokenType.kw_else.value
+    kinds = buffer.kinds
+    ends = []
+    depth = 0
+    for index, kind in enumerate(kinds):
+        if kind == lbrace or kind == lparen:
+            depth += 1
+        elif kind == rbrace or kind == rparen:
+            depth -= 1
+            if depth == 0 and kind == rbrace and (index + 1 == len(kinds) or kinds[index + 1] != kw_else):
+                ends.append(index + 1)
+        elif kind == semicolon and depth == 0:
+            ends.append(index + 1)
+    return ends
+
+# Parses the tokens first to last of the shared TokenBuffer with the given name as a program, for
+# Parser.ParseParallel in a worker process
+# Returns the names of its symbol ids in order and the program encoded by astnodes.encode_tree, or None if
+# parsing the run raises, which is taken as a syntax error as Recover does
+# The end token of the buffer is left out, the parser ends the program with its own
+def parse_chunk(name, first, last):
+    buffer = lex.attach_token_buffer(name)
+    try:
+        if last == len(buffer) and buffer.kind(last - 1) == lex.TokenType.end:
+            last -= 1
+        parser = Parser(buffer.text, [buffer[index] for index in range(first, last)])
+        try:
+            parser.Parse()
+        except Exception:
+            return None
+        return parser.lexer.symbols.names, ast.encode_tree(parser.ASTroot)
+    finally:
+        buffer.close()
+
+# Parses a block skipped by Parser.SkipBlock, interning its names with lexer, from the tokens kept for it
+# or, when there are none, from the tokens lexed from the '{' at offset start of the SourceText source
+# Its nodes are spanned from anchor, that of the statement the function is in, and its functions are lazy as well
+def parse_skipped_block(lexer, anchor, src, start, tokens=None):
+    if tokens is None:
+        parser = Parser(src.text, lexer.IterTokensFrom(src, start), lazy_bodies=True)
+        parser.skip_text = True
+    else:
+        parser = Parser(src, tokens, lazy_bodies=True)
+    parser.lexer = lexer
+    parser.anchor = anchor
+    parser.NextToken()
+    return ast.run(parser.ParseBlock())
+
+# Replaces the symbol ids in the values of a tree encoded by astnodes.encode_tree by their entries in ids
+def renumber_symbols(tree, ids):
+    shapes, kinds, _, _, values = tree
+    # For each shape, the number of values of a node and the positions of its symbol ids among them
+    layouts = []
+    for name, nodes, _ in shapes:
+        plain = [field for position, field in enumerate(getattr(ast, name).fields) if position not in nodes]
+        layouts.append((len(plain), [i for i, field in enumerate(plain) if field in ("symbol", "param_symbols")]))
+    index = 0
+    for kind in ast.unpack_numbers(kinds):
+        count, positions = layouts[kind]
+        for i in positions:
+            value = values[index + i]
+            if value.__class__ is list:
+                values[index + i] = [ids[symbol] for symbol in value]
+            elif value is not None:
+                values[index + i] = ids[value]
+        index += count
+
+# Statements directly inside node which are or may contain blocks, as places (owner, key) where owner[key] is the
+# statement, owner being the list of statements of a program or block, or the node whose attribute key holds a block
+def block_places(node):
+    if isinstance(node, (ast.ASTProgramNode, ast.ASTBlockNode)):
+        return [(node.stmts, index) for index in range(len(node.stmts))]
+    if isinstance(node, ast.ASTIfNode):
+        if node.else_block:
+            return [(node, "then_block"), (node, "else_block")]
+        return [(node, "then_block")]
+    if isinstance(node, (ast.ASTFunctionDeclNode, ast.ASTForNode, ast.ASTWhileNode)):
+        return [(node, "body")]
+    return []
+
+def place_get(owner, key):
+    return owner[key] if isinstance(key, int) else getattr(owner, key)
+
+def place_set(owner, key, node):
+    if isinstance(key, int):
+        owner[key] = node
+    else:
+        setattr(owner, key, node)
+
+# Updates program after an edit of its source which replaces deleted characters at offset with inserted
+# tokens is the list of significant tokens the program was parsed from, as lexed with trivia "skip" by the
+# default engine, and is relexed in place
+# Only the smallest function or block whose first and last tokens enclose every token which changed is parsed
+# again and put in place of the old one, the nodes outside it are kept and only their offsets shifted
+# Returns the program, which is a new one if no function or block could be parsed on its own
+def reparse(program, tokens, offset, deleted, inserted):
+    # The bodies a lazy parse left are parsed first, as they are parsed from the source before the edit
+    parse_lazy_bodies(program)
+    lexer = lex.Lexer()
+    old_text = tokens[-1].source.text
+    first, last, replaced = lexer.RelexRange(tokens, offset, deleted, inserted, "skip")
+    delta = len(inserted) - deleted
+    text = tokens[-1].source.text
+
+    # The tokens first to last replace old ones between low and high, the tokens outside are unchanged
+    low = tokens[first - 1].end if first else 0
+    high = tokens[last].start if last < len(tokens) else len(text)
+    # When only trivia was edited the tokens scanned again are the old ones, moved as the offsets are shifted
+    edited = len(replaced) != last - first or any(
+        new.type != old.type or new.start != (old.start + delta if old.start >= offset + deleted else old.start)
+        or text[new.start:new.end] != old_text[old.start:old.end]
+        for new, old in zip(tokens[first:last], replaced)
+    )
+
+    # Chain of the functions and blocks enclosing the edit from the outermost, a function or block can only
+    # enclose it if the statement holding it does, so the search goes down one level at a time
+    chain = []
+    places = block_places(program) if edited else []
+    while places:
+        owner, key = places.pop()
+        node = place_get(owner, key)
+        if not isinstance(node, (ast.ASTFunctionDeclNode, ast.ASTBlockNode)):
+            places.extend(block_places(node))
+        elif node.start < low and node.end - 1 + delta >= high:
+            chain.append((owner, key, node))
+            places = block_places(node)
+
+    for owner, key, node in reversed(chain):
+        start = lexer.FirstTokenEndingAfter(tokens, node.start)
+        end = lexer.FirstTokenEndingAfter(tokens, node.end - 1 + delta) + 1
+        parser = Parser(text, tokens[start:end])
+        parser.lexer.symbols = program.symbols
+        # A nested block is spanned from the anchor of its statement, which starts before the edit and so does
+        # not move, a top-level function from an anchor of its own
+        if owner is not program.stmts:
+            parser.anchor = node.anchor
+        parser.NextToken()
+        rule = parser.ParseBlock if isinstance(node, ast.ASTBlockNode) else parser.ParseFunctionDecl
+        # The range may no longer be a whole function or block, e.g. when the edit added a brace, in which case
+        # the one around it is tried
+        try:
+            replacement = ast.run(rule())
+        except Exception:
+            continue
+        if parser.crtToken.type != lex.TokenType.end:
+            continue
+        shift_spans(program, offset + deleted, delta)
+        place_set(owner, key, replacement)
+        if owner is program.stmts:
+            parser.anchor.owner = replacement
+        program.source = tokens[-1].source
+        return program
+
+    if edited:
+        parser = Parser(text, tokens)
+        parser.lexer.symbols = program.symbols
+        parser.Parse()
+        return parser.ASTroot
+    shift_spans(program, offset + deleted, delta)
+    program.source = tokens[-1].source
+    return program
+
+# Parses every function body in program which a parser with lazy_bodies left to be parsed on first use
+def parse_lazy_bodies(program):
+    if not program.lazy_bodies:
+        return
+    places = block_places(program)
+    while places:
+        places.extend(block_places(place_get(*places.pop())))
+    program.lazy_bodies = False
+
+# Shifts by delta the offsets of the nodes in program which are at or after offset
+# A top-level statement after the edit is moved as a whole by the shift of its anchor, or given an anchor of its
+# own if it shares one, and only the nodes of a statement around the edit are shifted one by one
+def shift_spans(program, offset, delta):
+    # The program spans the whole source, also when the edit is at its end
+    program.length += delta
+    if not delta:
+        return
+    for stmt in program.stmts:
+        start = stmt.start
+        # Nothing in a statement ending before the edit moves
+        if start + stmt.length <= offset:
+            continue
+        if start < offset:
+            shift_nodes(stmt, offset, delta)
+        elif stmt.anchor.owner is stmt:
+            stmt.anchor.shift += delta
+        else:
+            anchor = ast.Anchor(stmt)
+            for node in subtree(stmt):
+                node.offset = node.start + delta
+                node.anchor = anchor
+
+# Shifts the nodes under stmt, which starts before offset, for shift_spans
+# Every node after the edit moves, so the children are found inline rather than by ast.child_nodes
+def shift_nodes(stmt, offset, delta):
+    stack = [stmt]
+    while stack:
+        node = stack.pop()
+        start = node.start
+        # Nothing in a node ending before the edit moves
+        if start + node.length <= offset:
+            continue
+        # A node starting after the edit keeps its length, one around it grows or shrinks with it
+        if start >= offset:
+            node.offset += delta
+        else:
+            node.length += delta
+        for field in node.fields:
+            value = getattr(node, field)
+            if isinstance(value, ast.ASTNode):
+                stack.append(value)
+            elif value.__class__ is list or value.__class__ is tuple:
+                stack.extend(ast.nodes_in(value))
+
+# Returns the nodes under node, including node
+def subtree(node):
+    nodes = [node]
+    for node in nodes:
+        nodes.extend(ast.child_nodes(node))
+    return nodes
@@ -1,5 +1,15 @@
-from parser import Parser
-from astnodes import PrintNodesVisitor
+import contextlib
+import gc
+import io
+import marshal
+import os
+import sys
+import tempfile
+from lexer import Lexer
+from parser import Parser, reparse
+from parse_cache import ParseCache
+from astnodes import PrintNodesVisitor, child_nodes, encode_tree, paused_gc
+from lexer_benchmarks import generate_corpus
 
 test_inputs = [
     # Simple variable declaration with integer
@@ -201,3 +211,290 @@ if __name__ == "__main__":
             parser.ASTroot.accept(visitor)
         except Exception as e:
             print(f"Syntax Error: {e}")
+
+    # Nesting far deeper than the recursion limit, which the parser and the visitors handle with explicit stacks
+    print("\n--- Deep Nesting ---")
+    depth = 5 * sys.getrecursionlimit()
+    deep_inputs = {
+        "parentheses": "let x : int = " + "(" * depth + "1" + ")" * depth + ";",
+        "blocks": "{" * depth + "let x : int = 1;" + "}" * depth,
+        "if statements": "if (true) {" * depth + "__print 1;" + "}" * depth,
+    }
+    for name, code in deep_inputs.items():
+        try:
+            parser = Parser(code)
+            parser.Parse()
+            visitor = PrintNodesVisitor()
+            with contextlib.redirect_stdout(io.StringIO()):
+                parser.ASTroot.accept(visitor)
+            print(f"{depth} nested {name}: {visitor.node_count} nodes printed")
+        except Exception as e:
+            print(f"Syntax Error: {e}")
+
+    # The cyclic garbage collector keeps running while parsing and walking unless pause_gc or paused_gc asks for
+    # it to be paused, after which it is as it was before, also when it was off already
+    class GCProbe:
+        def visit_program_node(self, node):
+            self.enabled = gc.isenabled()
+    def probed_tokens(code, seen):
+        for token in Lexer().iter_tokens(code, "skip"):
+            seen.append(gc.isenabled())
+            yield token
+    code = deep_inputs["if statements"]
+    for pause_gc in (False, True):
+        seen = []
+        parser = Parser(code, probed_tokens(code, seen), pause_gc=pause_gc)
+        parser.Parse()
+        probe = GCProbe()
+        parser.ASTroot.accept(probe)
+        print(f"pause_gc={pause_gc}: GC on while parsing {all(seen)}, while walking {probe.enabled}, after {gc.isenabled()}")
+    with paused_gc():
+        parser.ASTroot.accept(probe)
+        with paused_gc():
+            pass
+        print(f"paused_gc: GC on while walking {probe.enabled}, after an inner pause {gc.isenabled()}")
+    print(f"after paused_gc: GC on {gc.isenabled()}")
+    gc.disable()
+    Parser(code, pause_gc=True).Parse()
+    print(f"pause_gc with the GC off: GC on after {gc.isenabled()}")
+    gc.enable()
+
+
+    # Incremental reparsing: after each edit the program must print the same as one parsed in full from the new
+    # source, with the functions the edit is outside of kept as the same nodes
+    print("\n--- Incremental Reparse ---")
+    source = """
+    fun first(a : int) -> int { return a + 1; }
+    fun second(b : int) -> int {
+        let c : int = b * 2;
+        if (c > 10) { return c; }
+        return b;
+    }
+    fun third() -> bool { return true; }
+    """
+    edits = {
+        "change a literal": (source.index("2;"), 1, "7"),
+        "add a statement to an inner block": (source.index("return c;"), 0, "__print c; "),
+        "add a statement to a function": (source.index("return b;"), 0, "let d : int = 3; "),
+        "add blank lines between functions": (source.index("fun third"), 0, "\n\n"),
+        "add a function": (source.index("fun third"), 0, "fun extra() -> int { return 0; } "),
+        "unbalance a block": (source.index("return c; }"), 0, "{"),
+    }
+    for name, (offset, deleted, inserted) in edits.items():
+        try:
+            tokens = list(Lexer().iter_tokens(source, "skip"))
+            parser = Parser(source, tokens)
+            parser.Parse()
+            functions = list(parser.ASTroot.stmts)
+            program = reparse(parser.ASTroot, tokens, offset, deleted, inserted)
+            expected = Parser(source[:offset] + inserted + source[offset + deleted:])
+            expected.Parse()
+            printed = []
+            for root in (program, expected.ASTroot):
+                with contextlib.redirect_stdout(io.StringIO()) as out:
+                    root.accept(PrintNodesVisitor())
+                printed.append(out.getvalue())
+            kept = sum(node in functions for node in program.stmts)
+            print(f"{name}: matches full parse {printed[0] == printed[1]}, {kept}/{len(functions)} functions kept")
+        except Exception as e:
+            print(f"{name}: Syntax Error: {e}")
+
+    # Error recovery: one parse reports every error, skipping only the statements they are in, and a program
+    # without errors parses the same as without recovery
+    print("\n--- Error Recovery ---")
+    source = """
+    let x : int = ;
+    let y : int = 5 $ 3;
+    fun f(a : int) -> int {
+        let z : int = a +;
+        if (a >) { __print 1; }
+        return a;
+    }
+    __print (1 + ;
+    }
+    let ok : bool = true;
+    fun g( -> int { return 1; }
+    let w : int = 2
+    """
+    parser = Parser(source, recover=True)
+    parser.Parse()
+    for error in parser.errors:
+        print(error)
+    parser.ASTroot.accept(PrintNodesVisitor())
+    matches = 0
+    for code in test_inputs:
+        recovering = Parser(code, recover=True)
+        recovering.Parse()
+        try:
+            parser = Parser(code)
+            parser.Parse()
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                parser.ASTroot.accept(PrintNodesVisitor())
+            with contextlib.redirect_stdout(io.StringIO()) as recovered:
+                recovering.ASTroot.accept(PrintNodesVisitor())
+            matches += not recovering.errors and out.getvalue() == recovered.getvalue()
+        except Exception as e:
+            # The first error reported is the one the parser stops at without recovery, or the lexical error
+            # the lexer skipped over where the parser without recovery stops at the error token
+            first = recovering.errors[0].message if recovering.errors else ""
+            matches += first == str(e) or first.startswith("Lexical Error")
+    print(f"{matches}/{len(test_inputs)} programs agree with parsing without recovery")
+
+    # Parse cache: a program parsed a second time from the same source must come from the cache and print the same,
+    # and the cache must stay within its size by removing the entries used least recently
+    print("\n--- Parse Cache ---")
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ParseCache(directory)
+        matches = 0
+        for code in test_inputs:
+            printed = []
+            for _ in range(2):
+                try:
+                    parser = Parser(code, cache=cache)
+                    parser.Parse()
+                    with contextlib.redirect_stdout(io.StringIO()) as out:
+                        parser.ASTroot.accept(PrintNodesVisitor())
+                    printed.append(out.getvalue())
+                except Exception as e:
+                    printed.append(f"Syntax Error: {e}")
+            matches += printed[0] == printed[1]
+        print(f"{matches}/{len(test_inputs)} programs print the same from the cache")
+        print(f"hits {cache.hits}, misses {cache.misses}")
+
+        # A damaged entry is a miss and is replaced
+        with open(cache.path(test_inputs[0]), "wb") as file:
+            file.write(b"not marshal")
+        Parser(test_inputs[0], cache=cache).Parse()
+        Parser(test_inputs[0], cache=cache).Parse()
+        print(f"after a damaged entry: hits {cache.hits}, misses {cache.misses}")
+
+        # So is an entry which marshal reads but which cannot be decoded into a tree, and it is removed at once
+        undecodable = 0
+        missing_class = ([("ASTMissingNode", (), ())], ("B", b"\0"), ("B", b"\0"), ("B", b"\0"), [])
+        for entry in (marshal.dumps(missing_class), marshal.dumps(None), marshal.dumps(([], [])), b""):
+            with open(cache.path(test_inputs[0]), "wb") as file:
+                file.write(entry)
+            undecodable += cache.load(test_inputs[0]) is None and not os.path.exists(cache.path(test_inputs[0]))
+        print(f"undecodable entries missed and removed: {undecodable}/4")
+
+        # Entries of the same size stored in order, with times set apart, of which only the four used last fit
+        # Reading the entry of source 6 again makes it used last, so storing source 0 evicts source 7 instead
+        small = ParseCache(os.path.join(directory, "small"))
+        sources = [f"let x : int = {i};" for i in range(10)]
+        Parser(sources[0], cache=small).Parse()
+        small.max_bytes = 4 * small.size()[1]
+        for i, code in enumerate(sources):
+            Parser(code, cache=small).Parse()
+            os.utime(small.path(code), ns=(i, i))
+        Parser(sources[6], cache=small).Parse()
+        Parser(sources[0], cache=small).Parse()
+        cached = [i for i, code in enumerate(sources) if os.path.exists(small.path(code))]
+        print(f"entries kept: {cached}")
+        # The directory is only scanned when the size counted from the entries stored goes over max_bytes
+        print(f"counted size matches the entries: {small.total == small.size()[1]}")
+
+    # Parallel parsing: the top-level statements parsed in runs by several workers must make the same AST,
+    # with the same symbol ids, as parsing them in one pass, and a syntax error must be the same one
+    print("\n--- Parallel Parsing ---")
+    valid_inputs = []
+    for code in test_inputs:
+        try:
+            Parser(code).Parse()
+            valid_inputs.append(code)
+        except Exception:
+            pass
+    source = generate_corpus(20) + "\n".join(valid_inputs) + """
+    if (true) { __print 1; } else { __print 2; }
+    for (let i : int = 0; i < 3; i = i + 1) { __print i; }
+    { let inner : int = 1; { __print inner; } }
+    """
+    serial = Parser(source)
+    serial.Parse()
+    for workers in (2, 3, 5):
+        parser = Parser(source)
+        parser.parallel_min_chars = 1
+        parser.Parse(workers)
+        same = encode_tree(parser.ASTroot) == encode_tree(serial.ASTroot)
+        print(f"{workers} workers: {'matches' if same else 'differs from'} serial parsing")
+    try:
+        parser = Parser(source + "let broken : int = ;" + source)
+        parser.parallel_min_chars = 1
+        parser.Parse(3)
+    except Exception as e:
+        print(f"3 workers: Syntax Error: {e}")
+    # Without as many cores as parallel_min_cores, None parses serially, never calling ParseParallel
+    parser = Parser(source)
+    parser.parallel_min_chars = 1
+    parser.parallel_min_cores = (os.cpu_count() or 1) + 1
+    parser.ParseParallel = None
+    parser.Parse(None)
+    same = encode_tree(parser.ASTroot) == encode_tree(serial.ASTroot)
+    print(f"None workers on too few cores: {'matches' if same else 'differs from'} serial parsing")
+    # Any other failure is raised, not hidden by parsing serially, here a bug in finding the statement ends
+    def failing_statement_ends(buffer):
+        raise IndexError("statement_ends failed")
+    parser_module = sys.modules[Parser.__module__]
+    statement_ends = parser_module.statement_ends
+    parser_module.statement_ends = failing_statement_ends
+    try:
+        parser = Parser(source)
+        parser.parallel_min_chars = 1
+        parser.Parse(3)
+        print("3 workers: the failure was hidden")
+    except IndexError as e:
+        print(f"3 workers: {e}")
+    finally:
+        parser_module.statement_ends = statement_ends
+
+    # Lazy function bodies: the bodies are skipped when parsing and parsed when first used, from the text when
+    # the parser lexes the source itself and from the tokens when it is given them, giving the same tree
+    print("\n--- Lazy Function Bodies ---")
+    source = generate_corpus(5) + """
+    fun nested(a : int) -> int {
+        /* a } in a comment { */
+        fun inner(b : int) -> int { return b; } // and }
+        if (a > 0) { return inner(a); } else { while (false) { } }
+        return 0;
+    }
+    __print nested(3);
+    """
+    expected = Parser(source)
+    expected.Parse()
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        expected.ASTroot.accept(PrintNodesVisitor())
+    for name, tokens in (("text", None), ("tokens", list(Lexer().iter_tokens(source, "skip")))):
+        parser = Parser(source, tokens, lazy_bodies=True)
+        parser.Parse()
+        lazy = [stmt for stmt in parser.ASTroot.stmts if getattr(stmt, "parse_body", None) is not None]
+        with contextlib.redirect_stdout(io.StringIO()) as printed:
+            parser.ASTroot.accept(PrintNodesVisitor())
+        print(f"{name}: {len(lazy)} bodies left to parse, matches eager parsing {printed.getvalue() == out.getvalue()}")
+    parser = Parser("fun broken() -> int { let x : int = ; } let y : int = 1;", lazy_bodies=True)
+    parser.Parse()
+    print(f"Body with an error: {len(parser.ASTroot.stmts)} statements parsed")
+    try:
+        parser.ASTroot.stmts[0].body
+    except Exception as e:
+        print(f"On first use: {e}")
+    try:
+        Parser("fun open() -> int { { return 1; }", lazy_bodies=True).Parse()
+    except Exception as e:
+        print(f"Unclosed body: {e}")
+
+    # Source spans: every node spans the source it was parsed from, and its line and column are looked up in
+    # the line index of the parser's source
+    print("\n--- Source Spans ---")
+    source = """let x : int = (1 + 2) * 3;
+fun f(a : int[2]) -> float {
+    return a[0] as float;
+}
+__print f(x);"""
+    parser = Parser(source)
+    parser.Parse()
+    nodes = [(parser.ASTroot, 0)]
+    while nodes:
+        node, depth = nodes.pop()
+        line, column = node.line_col(parser.source)
+        text = source[node.start:node.end].splitlines()
+        print(f"{'  ' * depth}{type(node).__name__} {line}:{column} {text[0]!r}{' ...' if len(text) > 1 else ''}")
+        nodes.extend((child, depth + 1) for child in reversed(child_nodes(node)))
@@ -1,5 +1,7 @@
 # astnodes used in various places to check types
 from astnodes import ASTIfNode, ASTRtrnNode, ASTWhileNode, ASTBlockNode, ASTArrayDeclNode, ASTIntegerNode, ASTForNode
+# Runs the checks of nested blocks without recursion
+from astnodes import run
 # Used for declarations, lookups, and scope management
 from symbol_table import SymbolTable
 
@@ -10,9 +12,14 @@ class SemanticAnalyzer:
     def __init__(self):
         self.symbol_table = SymbolTable()
         self.current_return_type = None
+        self.source = None # SourceText of the program, which walk locates the errors of the visits in
 
     # This method is called to check if a block always returns a value
     def does_block_always_return(self, block_node):
+        return run(self.block_always_returns(block_node))
+
+    # Generator doing the check, which yields the checks of nested blocks to run instead of recursing
+    def block_always_returns(self, block_node):
 
         for stmt in block_node.stmts:
 
@@ -22,8 +29,8 @@ class SemanticAnalyzer:
             
             # Checks recursively for return statements in blocks in if statements
             elif isinstance(stmt, ASTIfNode):
-                then_returns = self.does_block_always_return(stmt.then_block)
-                else_returns = self.does_block_always_return(stmt.else_block) if stmt.else_block else False
+                then_returns = yield self.block_always_returns(stmt.then_block)
+                else_returns = (yield self.block_always_returns(stmt.else_block)) if stmt.else_block else False
                 if then_returns and else_returns:
                     return True
                 
@@ -33,13 +40,18 @@ class SemanticAnalyzer:
 
             # Checks for blocks within blocks
             elif isinstance(stmt, ASTBlockNode):
-                if self.does_block_always_return(stmt):
+                if (yield self.block_always_returns(stmt)):
                     return True
                 
         # If loop finishes and nothing is returned, return False        
         return False
     
     # Visitor methods below implement type-checking rules for AST node types
+    # The ones with child nodes are generators which yield each child to astnodes.walk and are sent back its type
+
+    # A statement the parser skipped after a syntax error cannot be checked
+    def visit_error_node(self, node):
+        raise Exception(f"Semantic Error: Cannot analyse a statement with a syntax error: {node.message}")
 
     def visit_boolean_node(self, node):
         return "bool"
@@ -63,8 +75,8 @@ class SemanticAnalyzer:
     def visit_pad_read_node(self, node):
         
         # Checks if the expressions are integers
-        y_type = node.expr2.accept(self)
-        x_type = node.expr1.accept(self)
+        y_type = yield node.expr2
+        x_type = yield node.expr1
         if x_type != "int":
             raise Exception(f"Type Error: __read expects int for x, got {x_type}")
         if y_type != "int":
@@ -73,7 +85,7 @@ class SemanticAnalyzer:
         return "colour"  # returns a colour type
 
     def visit_pad_rand_int_node(self, node):
-        bound_type = node.expr.accept(self)
+        bound_type = yield node.expr
         if bound_type != "int":
             raise Exception(f"Type Error: __random_int expects an int, got {bound_type}")
         return "int"
@@ -81,8 +93,8 @@ class SemanticAnalyzer:
     def visit_binary_op_node(self, node):
 
         # Checks if right and left are the same type
-        right_type = node.right.accept(self)
-        left_type = node.left.accept(self)
+        right_type = yield node.right
+        left_type = yield node.left
         if left_type != right_type:
             raise Exception(f"Type Error: Mismatched operands: {left_type} and {right_type}")
 
@@ -103,7 +115,7 @@ class SemanticAnalyzer:
     def visit_function_call_node(self, node):
 
         # Checks if function was declared and gets type
-        entry = self.symbol_table.lookup(node.func_name)
+        entry = self.symbol_table.lookup(node.symbol)
         func_entry = entry["type"]
         if func_entry is None:
             raise Exception(f"Function '{node.func_name}' not declared before use.")
@@ -121,9 +133,9 @@ class SemanticAnalyzer:
         for (arg_node, (param_name, param_type, _)) in zip(node.args, expected_params):
             if param_type.endswith("[]"):
                 # This is an array parameter
-                self.symbol_table.lookup(arg_node.lexeme)
+                self.symbol_table.lookup(arg_node.symbol)
             else:
-                arg_type = arg_node.accept(self)
+                arg_type = yield arg_node
                 if arg_type != param_type:
                     raise Exception(f"In call to '{node.func_name}', expected type '{param_type}' for argument '{param_name}', got '{arg_type}'.")
 
@@ -132,7 +144,7 @@ class SemanticAnalyzer:
     
     # Type checking for unary operations
     def visit_unary_op_node(self, node):
-        operand_type = node.operand.accept(self)
+        operand_type = yield node.operand
 
         if node.op == "not":
             if operand_type != "bool":
@@ -149,14 +161,14 @@ class SemanticAnalyzer:
 
     # Type checking for assignment nodes
     def visit_assignment_node(self, node):
-        var_type = node.id.accept(self)
-        expr_type = node.expr.accept(self)
+        var_type = yield node.id
+        expr_type = yield node.expr
         if var_type != expr_type:
             raise Exception(f"Type Error: Cannot assign {expr_type} to variable of type {var_type}")
         
     # Type checking for cast nodes    
     def visit_cast_node(self, node):
-        expr_type = node.expr.accept(self)
+        expr_type = yield node.expr
         target_type = node.target_type
 
         valid_types = {"int", "float", "bool", "colour"}
@@ -177,15 +189,15 @@ class SemanticAnalyzer:
     # is the same as the type of the variable
     def visit_variable_decl_node(self, node):
         var_type = node.vartype
-        self.symbol_table.declare(node.identifier, var_type)
+        self.symbol_table.declare(node.symbol, var_type)
 
-        expr_type = node.expr.accept(self)
+        expr_type = yield node.expr
         if expr_type != var_type:
             raise Exception(f"Type Error: Cannot assign {expr_type} to variable of type {var_type}")
 
     # Gets the type of the variable
     def visit_variable_node(self, node):
-        entry = self.symbol_table.lookup(node.lexeme)
+        entry = self.symbol_table.lookup(node.symbol)
         var_type = entry["type"]
 
         # index_expr is used for arrays
@@ -194,7 +206,7 @@ class SemanticAnalyzer:
                 raise Exception(f"Type Error: Variable '{node.lexeme}' is not an array")
             
             # Gets the type of the index expression
-            idx_type = node.index_expr.accept(self)
+            idx_type = yield node.index_expr
             if idx_type != "int":
                 raise Exception("Type Error: Array index must be an integer")
             
@@ -214,7 +226,7 @@ class SemanticAnalyzer:
 
         # Declares the array in the symbol table
         self.symbol_table.declare(
-                node.identifier,
+                node.symbol,
                 node.vartype,
                 size=len(node.values), # size is the size of the array
                 values=node.values
@@ -222,14 +234,14 @@ class SemanticAnalyzer:
 
         # Checks the type of the size expression
         if node.size_expr:
-            size_type = node.size_expr.accept(self)
+            size_type = yield node.size_expr
             if size_type != "int":
                 raise Exception("Type Error: Array size must be of type 'int'")
 
         # Checks each value's type by iterating through the values
         # Reversed because of the way stack frames are created
         for val in reversed(node.values):
-            val_type = val.accept(self)
+            val_type = yield val
             if val_type != base_type:
                 raise Exception(
                     f"Type Error: Array '{node.identifier}' expects elements of type '{base_type}', got '{val_type}'"
@@ -237,25 +249,25 @@ class SemanticAnalyzer:
 
     # Goes to next expression
     def visit_print_node(self, node):
-        node.expr.accept(self)
+        yield node.expr
 
     # Checks the type of the delay node 
     def visit_delay_node(self, node):
-        delay_type = node.expr.accept(self)
+        delay_type = yield node.expr
         if delay_type != "int":
             raise Exception(f"Type Error: __delay expects 'int', got '{delay_type}'")
         
     # Checks the type of the clear node    
     def visit_clear_node(self, node):
-        clear_type = node.expr.accept(self)
+        clear_type = yield node.expr
         if clear_type != "colour":
             raise Exception(f"Type Error: __clear expects 'colour', got '{clear_type}'")
 
     # Checks the type of the write node
     def visit_write_node(self, node):
-        val_type = node.val_expr.accept(self)
-        y_type = node.y_expr.accept(self)
-        x_type = node.x_expr.accept(self)
+        val_type = yield node.val_expr
+        y_type = yield node.y_expr
+        x_type = yield node.x_expr
 
         if x_type != "int":
             raise Exception(f"Type Error: __write expects int for x, got '{x_type}'")
@@ -266,11 +278,11 @@ class SemanticAnalyzer:
 
     # Checks the type of the write box node    
     def visit_write_box_node(self, node):
-        val_type = node.val_expr.accept(self)
-        h_type = node.h_expr.accept(self)
-        w_type = node.w_expr.accept(self)
-        y_type = node.y_expr.accept(self)
-        x_type = node.x_expr.accept(self)
+        val_type = yield node.val_expr
+        h_type = yield node.h_expr
+        w_type = yield node.w_expr
+        y_type = yield node.y_expr
+        x_type = yield node.x_expr
 
         for label, typ in zip(["x", "y", "width", "height"], [x_type, y_type, w_type, h_type]):
             if typ != "int":
@@ -284,7 +296,7 @@ class SemanticAnalyzer:
         if self.current_return_type is None:
             raise Exception("Semantic Error: 'return' statement outside of function.")
 
-        expr_type = node.expr.accept(self)
+        expr_type = yield node.expr
         if expr_type != self.current_return_type:
             raise Exception(
                 f"Type Error: Return type '{expr_type}' does not match expected function return type '{self.current_return_type}'"
@@ -292,44 +304,44 @@ class SemanticAnalyzer:
 
     # Checks the type of the condition and goes into specific blocks
     def visit_if_node(self, node):
-        cond_type = node.condition_expr.accept(self)
+        cond_type = yield node.condition_expr
         if cond_type != "bool":
             raise Exception("Type Error: Condition in 'if' must be boolean")
         if node.else_block:
-            node.else_block.accept(self)
+            yield node.else_block
 
-            node.then_block.accept(self)
+            yield node.then_block
         else:
-            node.then_block.accept(self)
+            yield node.then_block
 
     # Checks the type of the condition and starts an initalization, and updates accordingly 
     def visit_for_node(self, node):
 
         # (e.g. let u:int = 0;)
         if node.init:
-            node.init.accept(self)
+            yield node.init
 
         # (e.g. i < 10;)
         if node.condition:
-            cond_type = node.condition.accept(self)
+            cond_type = yield node.condition
             if cond_type != "bool":
                 raise Exception(f"Type Error: for-loop condition must be 'bool', got '{cond_type}'")
         else:
             raise Exception("Syntax Error: for-loop requires a condition")
-        node.body.accept(self)
+        yield node.body
 
         # (e.g. i = i + 1)
         if node.update:
-            node.update.accept(self)
+            yield node.update
 
     # Checks the type of the condition and goes into specific blocks
     def visit_while_node(self, node):
 
-        cond_type = node.condition.accept(self)
+        cond_type = yield node.condition
         if cond_type != "bool":
             raise Exception("Type Error: Condition in 'while' must be boolean")
 
-        node.body.accept(self)
+        yield node.body
 
     
     def visit_function_decl_node(self, node):
@@ -339,7 +351,7 @@ class SemanticAnalyzer:
             raise Exception("Semantic Error: Functions must be declared in the global scope.")
         
         # Declares the function in the symbol table with the parameters
-        self.symbol_table.declare(node.name, {
+        self.symbol_table.declare(node.symbol, {
                 'type': node.return_type,
                 'kind': 'function',
                 'params': node.params,
@@ -350,23 +362,23 @@ class SemanticAnalyzer:
         self.symbol_table.enter_scope()
 
         # If the parameter is an array, extract its declared size for validation.
-        for name, typ, size_expr in node.params:
+        for (name, typ, size_expr), symbol in zip(node.params, node.param_symbols):
             if isinstance(typ, str) and typ.endswith("[]"):
                 # Determine size from literal size expression (assumes ASTIntegerNode)
                 if isinstance(size_expr, ASTIntegerNode):
                     size = int(size_expr.value)
                 else:
                     raise Exception(f"Semantic Error: Array parameter '{name}' must have a constant size.")
-                self.symbol_table.declare(name, typ, size=size)
+                self.symbol_table.declare(symbol, typ, size=size)
             else:
-                self.symbol_table.declare(name, typ)
+                self.symbol_table.declare(symbol, typ)
 
         # Assigns the current return type from the function
         self.current_return_type = node.return_type
 
         # Checks the types in the functions body
         for stmt in node.body.stmts:
-            stmt.accept(self)
+            yield stmt
         self.symbol_table.exit_scope()
 
         # Checks if the function always returns a value
@@ -377,12 +389,16 @@ class SemanticAnalyzer:
     def visit_block_node(self, node):
         self.symbol_table.enter_scope()
         for stmt in node.stmts:
-            stmt.accept(self)
+            yield stmt
         self.symbol_table.exit_scope()
 
     # Entry point for semantic analysis; visits all top-level program statements
     def visit_program_node(self, node):
 
+        # The symbol table is keyed on the ids the parser interned, and names them through the program's symbols
+        self.symbol_table.symbols = node.symbols
+        self.source = node.source
+
         # Loop checking if the array size is an integer
         for stmt in node.stmts:
             if isinstance(stmt, ASTArrayDeclNode) and stmt.size_expr and not isinstance(stmt.size_expr, ASTIntegerNode):
@@ -390,4 +406,4 @@ class SemanticAnalyzer:
 
         # Loops through the statements in the program
         for stmt in node.stmts:
-            stmt.accept(self)
+            yield stmt
@@ -1,3 +1,4 @@
+import sys
 from parser import Parser
 from semantic_analyzer import SemanticAnalyzer  # Make sure this is your visitor class name
 
@@ -544,3 +545,21 @@ for i, code in enumerate(test_programs):
         print("Semantic check passed.")
     except Exception as e:
         print(f"Semantic error: {e}")
+
+# Nesting far deeper than the recursion limit, including the return check through nested if/else blocks
+print("\n--- Deep Nesting ---")
+depth = 5 * sys.getrecursionlimit()
+deep_programs = {
+    "blocks": "{" * depth + "let x : int = 1;" + "}" * depth,
+    "if/else returns": "fun f() -> int {" + "if (true) { return 1; } else {" * depth + "return 2;" + "}" * depth + "}",
+    "unary operators": "let x : bool = " + "not " * depth + "true;",
+}
+for name, code in deep_programs.items():
+    try:
+        parser = Parser(code)
+        parser.Parse()
+        analyzer = SemanticAnalyzer()
+        parser.ASTroot.accept(analyzer)
+        print(f"{depth} nested {name}: Semantic check passed.")
+    except Exception as e:
+        print(f"Semantic error: {e}")
@@ -1,8 +1,29 @@
+# This class interns the identifiers of one compilation, giving each distinct name a small integer id
+# The scopes of the symbol table are keyed on these ids, and names maps an id back to its name for diagnostics
+class SymbolIds:
+
+    def __init__(self):
+        self.ids = {} # Name to id
+        self.names = [] # Id to name, the same string object is shared by every occurrence of the name
+
+    # This method returns the id of a name, giving it the next id the first time it is seen
+    def intern(self, name):
+        symbol = self.ids.get(name)
+        if symbol is None:
+            symbol = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return symbol
+
 class SymbolTable:
 
     # This class implements a symbol table for managing variable declarations
-    def __init__(self):
+    # Variables and functions are keyed on their ids from symbols, which is set from the program node
+    # As the ids are small and dense, visible is a list indexed by id holding the stack of the entries of that id
+    # in the open scopes, so a lookup indexes it once instead of trying every scope from the innermost
+    def __init__(self, symbols=None):
+        self.symbols = symbols # SymbolIds used to name the ids in error messages
         self.scopes = [{}]  # Stack of scopes
+        self.visible = [] # Id to the list of its entries in the open scopes, the innermost last
         self.scope_levels = [0] # Stack of scope levels
         self.index_stack = [0] # Stack of indices for each scope
         self.current_level = 0 # Number of current scope level
@@ -16,17 +37,19 @@ class SymbolTable:
 
     # This method is called when exiting a scope
     def exit_scope(self):
-        self.scopes.pop() # Removes the current scope
+        for name in self.scopes.pop(): # Removes the current scope
+            self.visible[name].pop() # and its entries from the visible ones
         self.scope_levels.pop() # Removes the number of previous level
         self.index_stack.pop() # Removes the index of the previous scope
         self.current_level -= 1 # Decrements the current level
 
     # This method is called to declare a variable or function in the current scope
     def declare(self, name, typ, *, kind=None, size=None, values=None):
+        self.check_symbol(name)
 
         # Checks if the name has already been declared in the current scope
         if name in self.scopes[-1]:
-            raise Exception(f"Semantic Error: Variable '{name}' already declared in this scope.")
+            raise Exception(f"Semantic Error: Variable '{self.name_of(name)}' already declared in this scope.")
 
         # Gets the last index of the current scope
         index = self.index_stack[-1]
@@ -38,7 +61,7 @@ class SymbolTable:
         slots = size if is_array else 1
 
         # Assigns all details about the variable to the symbol table 
-        self.scopes[-1][name] = {
+        entry = self.scopes[-1][name] = {
             "type": typ,
             "index": index,
             "level": self.current_level - 1,
@@ -47,15 +70,29 @@ class SymbolTable:
             "values": values,
         }
 
+        # Makes the entry the visible one for its id
+        if name >= len(self.visible):
+            self.visible.extend([] for _ in range(name + 1 - len(self.visible)))
+        self.visible[name].append(entry)
+
         # Updates the index after the allocated slot/s
         self.index_stack[-1] += slots
 
     # This method is called to look up where a variable or function has been declared in the symbol table
     def lookup(self, name):
+        self.check_symbol(name)
 
         # Checks if the name has been used before declaration
-        # It checks by starting from the last scope (global) and goes backwards
-        for level in range(len(self.scopes) - 1, -1, -1):
-            if name in self.scopes[level]:
-                return self.scopes[level][name]
-        raise Exception(f"Semantic Error: Variable '{name}' used before declaration.")
+        # The last entry of the id is the one in the innermost scope which declares it
+        if name < len(self.visible) and self.visible[name]:
+            return self.visible[name][-1]
+        raise Exception(f"Semantic Error: Variable '{self.name_of(name)}' used before declaration.")
+
+    # This method checks that a node has the id the parser interned for its name
+    def check_symbol(self, symbol):
+        if symbol is None:
+            raise Exception("Semantic Error: Identifier has no symbol id, the node was not built by the parser.")
+
+    # This method returns the name of an id for error messages
+    def name_of(self, symbol):
+        return self.symbols.names[symbol] if self.symbols is not None else symbol